@@ -15,146 +15,217 @@
 #     - взвешенное среднее значение цены за период
 
 import pandas as pd
-import numpy as np
 import psycopg2
 import logging
+import argparse
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 
 
-from sqlalchemy import create_engine
 from sqlalchemy import text
 from transliterate import translit
 from omegaconf import OmegaConf
 
+import paths  # the repository root on sys.path for zion17
+from db import copy_frame, get_engine, load_sql, read_query, read_sql
+from features import history_rows, series_features, split_series
+from snapshot import read_table
+from zion17.metrics import Stage, count_rows
 
-# add write logging to file
-logging.basicConfig(
-    level=logging.INFO,
-    filename="../logs/logs_analytics.log",
-    filemode="a",
-    format="%(asctime)s: %(levelname)s: %(message)s"
-)
-logging.info('----------------------------------------------')
 
-try:
-    # read configuration
-    conf = OmegaConf.load('/home/tests/tests/vscode/myfin_by_analize/conf/server/db/postgres.yaml')
-    # create db engine
-    engine = create_engine(
-        f"postgresql+psycopg2://{conf.postgres.user}:{conf.postgres.password}@{conf.postgres.host}:{conf.postgres.port}/{conf.postgres.dbname}"
-        )
+SERIES_KEY = ['bank_name', 'currency', 'side']
 
-    logging.info(" :::   Read raw data")
-    with open('./sql/myfin_raw_data.sql', 'r') as query:
-        df = pd.read_sql_query(query.read(), engine.connect(), parse_dates={'date_page':'%Y-%m-%d'})
-    
-    logging.info(' :::   Read raw data                  : success')
 
-    # clear bank names
-    df = df.sort_values(['bank_name','date_page'])
+def bank_slug(bank_name):
+    return translit(
+        bank_name.lower().replace(' ', '_').replace('-', '_'),
+        language_code='ru',
+        reversed=True
+        ).replace("'", '')
 
-    df['bank_name'] = df['bank_name'].apply(
-        lambda x: translit(
-            x.lower().replace(' ', '_').replace('-', '_'),
-            language_code='ru',
-            reversed=True
-            ).replace("'", '')
-        )
-    logging.info(' :::   Clear bank names               : success')
-
-
-    # functions for calculating series of price up and down
-    def count_up(df):
-        cnt_up = 0
-        result = []
-        for idx, row in df.iterrows():
-            if row['is_up'] == 1:
-                cnt_up += 1
-            elif row['is_up'] in [0, -1] and cnt_up > 0:
-                cnt_up = 0
-            result.append(cnt_up)
-        
-        df['cnt_up'] = result
-        return df
-
-
-    def count_down(df):
-        cnt_down = 0
-        result = []
-        for idx, row in df.iterrows():
-            if row['is_up'] == -1:
-                cnt_down += 1
-            elif row['is_up'] in [0, 1] and cnt_down > 0:
-                cnt_down = 0
-            result.append(cnt_down)
-        
-        df['cnt_down'] = result
-        return df
-
-
-    # the function of calculating statistics on dataframes
-    def new_features(list_datarfames, list_periods):
-        X = pd.DataFrame()
-
-        for dataframe in list_datarfames:
-            dataframe['diff_day'] = -dataframe.iloc[:, 2].diff().fillna(0)
-            suffix = dataframe.name
-            num_col = 1
-            for win in list_periods:  
-                
-                mean_decay = lambda x: (x * np.power(0.9, np.arange(win)[::-1])).sum()
-                diff_fl = lambda x: x[0] - x[-1]
-
-                X[f'diff_mean_{win}_{suffix}'] = dataframe['diff_day'].rolling(window=win-1).mean().fillna(0)
-                X[f'mean_decay_{win}_{suffix}'] = dataframe.iloc[:, num_col].rolling(window=win).apply(mean_decay, raw=True)
-                X[f'diff_fl_{win}_{suffix}'] = dataframe.iloc[:, num_col].rolling(window=win).apply(diff_fl, raw=True)
-                X[f'mean_{win}_{suffix}'] = dataframe.iloc[:, num_col].rolling(window=win).mean().fillna(0)
-                X[f'median_{win}_{suffix}'] = dataframe.iloc[:, num_col].rolling(window=win).median().fillna(0)
-                X[f'min_{win}_{suffix}'] = dataframe.iloc[:, num_col].rolling(window=win).min().fillna(0)
-                X[f'max_{win}_{suffix}'] = dataframe.iloc[:, num_col].rolling(window=win).max().fillna(0)
-                X[f'std_{win}_{suffix}'] = dataframe.iloc[:, num_col].rolling(window=win).std().fillna(0)
-
-        return X
-
-
-    # cleaning the mart
+
+@Stage('features')
+def main(full=False):
+    """
+    Пересчет витрины признаков myfin_dm.myfin_by_for_model
+    Args:
+        full (bool): Очистить витрину и пересчитать ее по всей истории
+    Returns:
+        int: Количество новых строк витрины
+    """
+    # read configuration
+    conf_features = OmegaConf.load('../conf/analytics/features.yaml').features
+    engine = get_engine()
+
+    # normalized daily view, the mart and its watermarks (the last date of every series already written)
     with engine.connect() as conn:
-        conn.exec_driver_sql("DROP TABLE IF EXISTS myfin_dm.myfin_by_for_model")
+        conn.exec_driver_sql(load_sql('myfin_dm_daily_ddl'))
+        conn.exec_driver_sql(load_sql('myfin_dm_for_model_ddl'))
         conn.commit()
-    logging.info(' :::   Mart table mart_for_model drop : success')
 
-    logging.info(' :::   Start counting bank statistics')
-    for bank_name in df['bank_name'].drop_duplicates().values.tolist():
-        if bank_name == 'nbrb':
-            logging.info(f' :::       Bank: {bank_name}')
-            df_bank = df.loc[df['bank_name'] == bank_name].copy()
-            df_bank.name = 'price_usd_sell'
-
-            df_bank.set_index('date_page', inplace=True)
-            
-            # we consider a series of price up and down
-            df_bank['is_up'] = np.where(
-                (df_bank['price_value_usd_sell'] - df_bank['price_value_usd_sell'].shift(1)) > 0,
-                1, np.where(
-                    (df_bank['price_value_usd_sell'] - df_bank['price_value_usd_sell'].shift(1)) < 0,
-                    -1, 0
-                    )
+        # clear bank names: transliterate only the names not seen before,
+        # the daily view joins the slugs on the server
+        new_bank_names = [row[0] for row in conn.exec_driver_sql(load_sql('myfin_raw_new_bank_names'))]
+        if new_bank_names:
+            conn.execute(
+                text("INSERT INTO myfin_dm.bank_slug (bank_name, bank_slug) VALUES (:bank_name, :bank_slug) ON CONFLICT DO NOTHING"),
+                [{'bank_name': name, 'bank_slug': bank_slug(name)} for name in new_bank_names]
                 )
-            df_bank = count_up(df_bank)
-            df_bank = count_down(df_bank)
-            df_bank.drop('is_up', axis=1, inplace=True)
+        conn.exec_driver_sql("REFRESH MATERIALIZED VIEW CONCURRENTLY myfin_dm.myfin_by_daily")
+        conn.commit()
+        logging.info(f' :::   Clear bank names               : success, new names: {len(new_bank_names)}')
+
+    watermarks = read_query(
+        "SELECT bank_name, currency, side, date_page FROM myfin_dm.myfin_by_for_model_watermark"
+        ).set_index(SERIES_KEY)['date_page'].to_dict()
+    backfilled = read_sql('myfin_dm_backfilled_dates').set_index(SERIES_KEY)['date_page'].to_dict()
+
+    # every series is recomputed after its restart date: the watermark, or the day
+    # before the earliest date the crawler has filled behind it since
+    restarts = {
+        key: min(watermark, backfilled[key] - pd.Timedelta(days=1)) if key in backfilled else watermark
+        for key, watermark in watermarks.items()
+        }
+    full_refresh = full or not watermarks
+    if full_refresh:
+        logging.info(' :::   Mode: full rebuild')
+        filters = None
+    else:
+        # a bank is read from the history_rows-th row before the earliest restart of its series
+        # (the history the largest window needs), a bank with a series without watermark from the start
+        series = [(bank_name, currency, side) for bank_name in {key[0] for key in watermarks}
+                  for currency in conf_features.currencies for side in conf_features.sides]
+        bank_restarts = {}
+        for key in series:
+            restart = restarts.get(key, pd.Timestamp('1900-01-01'))
+            bank_restarts[key[0]] = min(bank_restarts.get(key[0], restart), restart)
+        df_start = read_sql('myfin_dm_history_start', {
+            'banks': list(bank_restarts),
+            'restarts': [restart.date() for restart in bank_restarts.values()],
+            'rows': history_rows(conf_features.periods),
+            })
+        history_start = dict(zip(df_start['bank_name'], df_start['date_page']))
+        # no rows up to the restart date: nothing before it to read
+        banks_from = {bank_name: history_start.get(bank_name, restart) for bank_name, restart in bank_restarts.items()}
+        filters = [[('bank_name', '=', bank_name), ('date_page', '>=', date_from)] for bank_name, date_from in sorted(banks_from.items())]
+        # new banks have no watermarks at all
+        filters.append([('bank_name', 'not in', sorted(banks_from))])
+        logging.info(
+            f' :::   Mode: incremental, {len(banks_from)} banks from their watermarks, '
+            f'{len(backfilled)} series with back-filled dates'
+            )
 
-            # counting statistics by windows
-            list_periods = [5, 7, 14, 21, 28, 35, 60, 100]
-            df_new_features = new_features([df_bank,], list_periods)
-            df_bank = pd.concat([df_bank, df_new_features], axis=1)
-            df_bank.dropna(inplace=True)
-            df_bank['y'] = df_bank['price_value_usd_sell'].shift(-1)
-            df_bank['y_predict'] = None
+    logging.info(" :::   Read raw data")
+    with Stage('features.read'):
+        df = read_table('daily', filters=filters)
+        count_rows(rows_out=len(df))
+    count_rows(rows_in=len(df))
+    logging.info(' :::   Read raw data                  : success')
 
-            # writing to the database
-            df_bank.to_sql(name='myfin_by_for_model', con=engine, schema='myfin_dm', if_exists='append')
+    # every (bank, currency, side) series is an independent task for the process pool
+    logging.info(' :::   Start counting bank statistics')
+    list_series = split_series(df, conf_features.currencies, conf_features.sides)
+    logging.info(f' :::       Series: {len(list_series)}')
+
+    # the forked workers must not inherit the pooled connections of the engine
+    engine.dispose()
+    with Stage('features.compute'), ProcessPoolExecutor(max_workers=conf_features.n_jobs) as pool:
+        list_marts = list(pool.map(
+            series_features,
+            list_series,
+            repeat(list(conf_features.periods)),
+            chunksize=max(1, len(list_series) // (4 * conf_features.n_jobs))
+            ))
+    df_mart = pd.concat([df_series for df_series in list_marts if not df_series.empty], ignore_index=True)
+
+    # incremental mode writes only the rows after the restart date of their series,
+    # the last row before it gets the now known y (the price of the next day)
+    df_mart['restart'] = pd.to_datetime(pd.Series(
+        [restarts.get(key) for key in zip(df_mart['bank_name'], df_mart['currency'], df_mart['side'])],
+        index=df_mart.index, dtype='object'
+        ))
+    df_y_update = pd.DataFrame()
+    if not full_refresh:
+        df_behind = df_mart.loc[df_mart['date_page'] <= df_mart['restart']]
+        df_y_update = df_behind.loc[df_behind.groupby(SERIES_KEY)['date_page'].idxmax()]
+        df_y_update = df_y_update.loc[df_y_update['y'].notna()]
+        df_mart = df_mart.loc[df_mart['restart'].isna() | (df_mart['date_page'] > df_mart['restart'])]
+    df_mart = df_mart.drop(columns='restart')
+    logging.info(f' :::       New rows: {len(df_mart)}')
+
+    # the rows of a back-filled series after its restart date are written again
+    df_rewrite = pd.DataFrame(
+        [] if full_refresh else [(*key, restarts[key]) for key in backfilled],
+        columns=SERIES_KEY + ['date_page']
+        )
+    df_watermark = pd.concat([
+        df_mart.groupby(SERIES_KEY, as_index=False)['date_page'].max(),
+        # a back-filled series without new rows keeps its watermark with a new updated_at
+        pd.DataFrame([(*key, watermarks[key]) for key in df_rewrite[SERIES_KEY].itertuples(index=False, name=None)],
+                     columns=SERIES_KEY + ['date_page']),
+        ]).groupby(SERIES_KEY, as_index=False)['date_page'].max()
+
+    with Stage('features.write'), engine.begin() as conn:
+        if full_refresh:
+            # cleaning the mart
+            conn.exec_driver_sql("TRUNCATE myfin_dm.myfin_by_for_model, myfin_dm.myfin_by_for_model_watermark")
+            logging.info(' :::   Mart table mart_for_model clear: success')
+
+        if not df_rewrite.empty:
+            conn.execute(
+                text("""
+                    DELETE FROM myfin_dm.myfin_by_for_model
+                    WHERE bank_name = :bank_name AND currency = :currency AND side = :side AND date_page > :date_page
+                    """),
+                df_rewrite.to_dict('records')
+                )
+            logging.info(f' :::   Back-filled series rewritten   : {len(df_rewrite)}')
+
+        # writing to the database
+        copy_frame(conn, df_mart, 'myfin_dm', 'myfin_by_for_model', chunksize=conf_features.copy_chunksize)
+
+        if not df_y_update.empty:
+            conn.execute(
+                text("""
+                    UPDATE myfin_dm.myfin_by_for_model
+                    SET y = :y
+                    WHERE bank_name = :bank_name AND currency = :currency AND side = :side AND date_page = :date_page
+                    """),
+                df_y_update[['bank_name', 'currency', 'side', 'date_page', 'y']].to_dict('records')
+                )
+
+        if not df_watermark.empty:
+            conn.execute(
+                text("""
+                    INSERT INTO myfin_dm.myfin_by_for_model_watermark (bank_name, currency, side, date_page, updated_at)
+                    VALUES (:bank_name, :currency, :side, :date_page, now())
+                    ON CONFLICT (bank_name, currency, side)
+                    DO UPDATE SET date_page = EXCLUDED.date_page, updated_at = EXCLUDED.updated_at
+                    """),
+                df_watermark.to_dict('records')
+                )
 
     logging.info(' :::   Create mart for model          : success')
-except Exception as e:
-    logging.debug(e)
+    count_rows(rows_out=len(df_mart))
+    return len(df_mart)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the feature mart myfin_dm.myfin_by_for_model')
+    parser.add_argument('--full', action='store_true', help='drop the mart and rebuild it from the whole raw history')
+    args = parser.parse_args()
+
+    # add write logging to file
+    logging.basicConfig(
+        level=logging.INFO,
+        filename="../logs/logs_analytics.log",
+        filemode="a",
+        format="%(asctime)s: %(levelname)s: %(message)s"
+    )
+    logging.info('----------------------------------------------')
+
+    try:
+        main(full=args.full)
+    except Exception as e:
+        logging.debug(e)
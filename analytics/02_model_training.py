@@ -1,77 +1,182 @@
 import pandas as pd
 import numpy as np
 import psycopg2
-from sqlalchemy import create_engine
 from omegaconf import OmegaConf
 import logging
-import os
-from datetime import date
+import time
+from datetime import datetime
 
 from sklearn.model_selection import TimeSeriesSplit
-from sklearn.pipeline import Pipeline
-from sklearn.preprocessing import StandardScaler
-from sklearn.linear_model import LinearRegression
 
-from joblib import dump
-
-
-# add write logging to file
-logging.basicConfig(
-    level=logging.INFO,
-    filename="../logs/logs_analytics.log",
-    filemode="a",
-    format="%(asctime)s: %(levelname)s: %(message)s"
-)
-logging.info('----------------------------------------------')
-
-conf = OmegaConf.load('/home/tests/tests/vscode/myfin_by_analize/conf/server/db/postgres.yaml')
-engine = create_engine(
-    f"postgresql+psycopg2://{conf.postgres.user}:{conf.postgres.password}@{conf.postgres.host}:{conf.postgres.port}/{conf.postgres.dbname}"
+import paths  # the repository root on sys.path for zion17
+import backtest
+import forecast
+import registry
+from snapshot import read_table
+from zion17.metrics import Stage, count_rows
+
+
+def fit_full(conf_model, df_X_train, df_y_train):
+    """
+    Обучение с нуля с оценкой на TimeSeriesSplit
+        Модель остается обученной на последнем train-фолде
+    Args:
+        conf_model (omegaconf): Настройки модели
+        df_X_train (pandas dataframe): Признаки
+        df_y_train (pandas dataframe): Целевая переменная
+    Returns:
+        tuple: Модель и score последнего фолда
+    """
+    pipeline = backtest.make_pipeline(conf_model.estimator, conf_model)
+    tscv = TimeSeriesSplit(n_splits=conf_model.n_splits)
+
+    score = None
+    for train_index, test_index in tscv.split(df_X_train):
+
+        logging.info(f"TRAIN: {train_index.min()} - {train_index.max()}, TEST: {test_index.min()} - {test_index.max()}")
+
+        X_train, X_test = df_X_train.iloc[train_index], df_X_train.iloc[test_index]
+        y_train, y_test = df_y_train.iloc[train_index], df_y_train.iloc[test_index]
+
+        pipeline.fit(X_train, y_train.to_numpy())
+
+        score = pipeline.score(X_test, y_test)
+        logging.info(f"Accuracy: {score}")
+
+    return pipeline, score
+
+
+def fit_warm(conf_model, pipeline, df_X_new, df_y_new):
+    """
+    Дообучение sgd-модели только на новых строках через partial_fit
+        score считается на новых строках до дообучения, scaler заморожен
+        после первого обучения: иначе сдвиг его среднего и масштаба менял бы
+        смысл уже выученных коэффициентов
+    Args:
+        conf_model (omegaconf): Настройки модели
+        pipeline (sklearn pipeline): Модель с предыдущего водяного знака
+        df_X_new (pandas dataframe): Признаки новых строк
+        df_y_new (pandas dataframe): Целевая переменная новых строк
+    Returns:
+        tuple: Модель и score на новых строках
+    """
+    score = pipeline.score(df_X_new, df_y_new) if len(df_X_new) > 1 else None
+    logging.info(f"Accuracy on {len(df_X_new)} new rows before update: {score}")
+
+    scaler, regressor = pipeline.named_steps['scaler'], pipeline.named_steps['classifier']
+    if 'select' in pipeline.named_steps:
+        df_X_new = pipeline.named_steps['select'].transform(df_X_new)
+    X_scaled = scaler.transform(df_X_new)
+    for _ in range(conf_model.sgd.epochs):
+        regressor.partial_fit(X_scaled, df_y_new.to_numpy())
+    return pipeline, score
+
+
+def train_group(conf_model, df_mart, currency, side):
+    """
+    Обучение модели одной пары (currency, side) на рядах всех банков
+        Модель с тем же ключом (хеш признаков, водяной знак) переиспользуется,
+        sgd-модель дообучается от последней модели с тем же хешем признаков,
+        иначе с backtest.enabled модель выбирается бэктестом кандидатов
+    Args:
+        conf_model (omegaconf): Настройки модели
+        df_mart (pandas dataframe): Витрина
+        currency (string): Валюта
+        side (string): sell или buy
+    Returns:
+        tuple: Модель и ее имя в registry (хеш признаков/водяной знак)
+    """
+    horizons = list(conf_model.horizons)
+    targets = forecast.target_columns(horizons)
+
+    df = df_mart.loc[(df_mart['currency'] == currency) & (df_mart['side'] == side)]
+    df = df.join(forecast.horizon_targets(df, horizons))
+    df = df.loc[(df['date_page'] >= pd.Timestamp(conf_model.date_from)) & df[targets].notna().all(axis=1)]
+    # walk-forward folds need the rows in time order
+    df = df.sort_values(['date_page', 'bank_name']).reset_index(drop=True)
+    count_rows(rows_in=len(df))
+
+    logging.info(" :::   Create X_train, y_train")
+    columns = registry.feature_columns(df.drop(columns=targets))
+    df_X_train = df[columns].copy()
+    df_y_train = df[targets].copy()
+
+    bank_name = 'all'
+    features = registry.feature_hash(columns, OmegaConf.to_container(conf_model))
+    watermark = df['date_page'].max().strftime('%Y-%m-%d')
+    model_name = f'{features}/{watermark}'
+    logging.info(f"SERIES {bank_name} {currency} {side}, features {features}, watermark {watermark}, rows {len(df)}")
+
+    pipeline = registry.get(bank_name, currency, side, features, watermark)
+    if pipeline is not None:
+        logging.info(" :::   Data has not changed, the registered model is reused")
+        return pipeline, model_name
+
+    started = time.perf_counter()
+    previous, previous_meta = (None, None)
+    if conf_model.estimator == 'sgd':
+        previous, previous_meta = registry.latest(bank_name, currency, side, features)
+
+    # Learning model
+    report = None
+    if (previous is not None and previous_meta['watermark'] < watermark
+            and hasattr(previous.named_steps['classifier'], 'partial_fit')):
+        new_rows = df['date_page'] > pd.Timestamp(previous_meta['watermark'])
+        logging.info(f" :::   Warm start from {previous_meta['watermark']}, new rows: {new_rows.sum()}")
+        pipeline, score = fit_warm(conf_model, previous, df_X_train.loc[new_rows], df_y_train.loc[new_rows])
+        mode = 'warm_start'
+    elif conf_model.backtest.enabled:
+        gap = max(horizons) * df['bank_name'].nunique()
+        pipeline, score, report = backtest.select_model(conf_model, df_X_train, df_y_train, df['price_value'], gap)
+        mode = 'backtest'
+    else:
+        pipeline, score = fit_full(conf_model, df_X_train, df_y_train)
+        mode = 'full'
+    train_seconds = time.perf_counter() - started
+
+    logging.info(f" :::   Learning model success ({mode}, {train_seconds:.2f}s)")
+
+    registry.save(
+        pipeline, bank_name, currency, side, features, watermark,
+        columns=columns, horizons=horizons, estimator=conf_model.estimator, mode=mode, rows=len(df),
+        score=score, backtest=report, train_seconds=round(train_seconds, 3),
+        trained_at=datetime.now().isoformat(timespec='seconds'),
+        )
+    return pipeline, model_name
+
+
+@Stage('train')
+def main(df_mart=None):
+    """
+    Обучение моделей прогноза на horizons дней для всех пар (currency, side)
+    Args:
+        df_mart (pandas dataframe): Витрина, если уже прочитана
+    Returns:
+        dict: (currency, side) -> (модель, имя модели)
+    """
+    conf_model = OmegaConf.load('../conf/analytics/model.yaml').model
+    conf_features = OmegaConf.load('../conf/analytics/features.yaml').features
+
+    logging.info(" :::   Read raw data")
+    if df_mart is None:
+        df_mart = read_table('mart')
+
+    models = {}
+    for currency in conf_features.currencies:
+        for side in conf_features.sides:
+            if ((df_mart['currency'] == currency) & (df_mart['side'] == side)).any():
+                models[(currency, side)] = train_group(conf_model, df_mart, currency, side)
+    return models
+
+
+if __name__ == '__main__':
+    # add write logging to file
+    logging.basicConfig(
+        level=logging.INFO,
+        filename="../logs/logs_analytics.log",
+        filemode="a",
+        format="%(asctime)s: %(levelname)s: %(message)s"
     )
+    logging.info('----------------------------------------------')
 
-logging.info(" :::   Read raw data")
-with open('./sql/myfin_dm_read.sql', 'r') as query:
-    df = pd.read_sql_query(query.read(), engine.connect(), parse_dates={'date_page':'%Y-%m-%d'})
-engine.connect().close()
-
-logging.info(" :::   Create X_train, y_train")
-df_X_train = df.drop(columns=['date_page', 'bank_name', 'y', 'y_predict'], axis=1).copy()
-df_y_train = df[['y']].copy()
-# Learning model
-for bank in df.bank_name.drop_duplicates().values.tolist():
-    if bank == 'nbrb':
-        logging.info(f"BANK {bank}")
-
-        tasks = [
-            ('scaler', StandardScaler()),
-            ('classifier', LinearRegression())
-        ]
-
-        pipeline = Pipeline(tasks)
-
-        tscv = TimeSeriesSplit(n_splits=5)
-
-        for train_index, test_index in tscv.split(df_X_train):
-
-            logging.info(f"TRAIN: {train_index.min()} - {train_index.max()}, TEST: {test_index.min()} - {test_index.max()}")
-            
-            X_train, X_test = df_X_train.iloc[train_index], df_X_train.iloc[test_index]
-            y_train, y_test = df_y_train.iloc[train_index], df_y_train.iloc[test_index]
-
-            pipeline.fit(X_train, y_train)
-
-            score = pipeline.score(X_test, y_test)
-            logging.info(f"Accuracy: {score}")
-
-logging.info(" :::   Learning model success")
-
-folder_name = date.today().strftime('%Y-%m-%d')
-
-if not os.path.exists(f'./models/{folder_name}'):
-    os.makedirs(f'./models/{folder_name}')
-    logging.info(f"Папка {folder_name} успешно создана")
-else:
-    logging.info(f"Папка {folder_name} уже существует")
-
-dump(pipeline, f'./models/{folder_name}/zion17.joblib')
-logging.info(f" :::   Save model to {folder_name}")
+    main()
@@ -1,50 +1,74 @@
 import pandas as pd
 import numpy as np
 import psycopg2
-from sqlalchemy import create_engine
 from omegaconf import OmegaConf
 import logging
 
-from joblib import load
-from datetime import date
-
-# add write logging to file
-logging.basicConfig(
-    level=logging.INFO,
-    filename="../logs/logs_analytics.log",
-    filemode="a",
-    format="%(asctime)s: %(levelname)s: %(message)s"
-)
-logging.info('----------------------------------------------')
-
-conf = OmegaConf.load('/home/tests/tests/vscode/myfin_by_analize/conf/server/db/postgres.yaml')
-engine = create_engine(
-    f"postgresql+psycopg2://{conf.postgres.user}:{conf.postgres.password}@{conf.postgres.host}:{conf.postgres.port}/{conf.postgres.dbname}"
-    )
+import paths  # the repository root on sys.path for zion17
+from db import get_engine, load_sql
+import forecast
+import registry
+from snapshot import read_table
+from zion17.metrics import Stage, count_rows
+
 
-logging.info(" :::   Read raw data")
-try:
-    with open('./sql/myfin_dm_read_for_predict.sql', 'r') as query:
-        df = pd.read_sql_query(query.read(), engine.connect())
-    engine.connect().close()
+@Stage('predict')
+def main(df_mart=None, models=None):
+    """
+    Прогноз на horizons дней для всех рядов витрины с записью в myfin_dm.myfin_by_predict
+        Один вызов predict на модель (currency, side) для последних строк всех банков
+    Args:
+        df_mart (pandas dataframe): Витрина, если уже прочитана
+        models (dict): (currency, side) -> (модель, имя модели), по умолчанию последние из registry
+    Returns:
+        pandas dataframe: Прогнозы, строка на (ряд, горизонт)
+    """
+    engine = get_engine()
+    conf_model = OmegaConf.load('../conf/analytics/model.yaml').model
+    horizons = list(conf_model.horizons)
 
-    df = df.loc[df['bank_name'] == 'nbrb'].reset_index(drop=True).copy()
-    date_page = df.at[0, 'date_page'].strftime('%Y-%m-%d')
-    X_test = df.drop(['date_page', 'bank_name', 'y', 'y_predict'], axis=1).copy()
+    logging.info(" :::   Read raw data")
+    if df_mart is None:
+        df_mart = read_table('mart')
+    count_rows(rows_in=len(df_mart))
+    columns = registry.feature_columns(df_mart)
 
-    logging.info(" :::   Load Model")
-    folder_name = date.today().strftime('%Y-%m-%d')
-    model = load(f'./models/{folder_name}/zion17.joblib')
+    if models is None:
+        logging.info(" :::   Load Models")
+        features = registry.feature_hash(columns, OmegaConf.to_container(conf_model))
+        models = {}
+        for currency, side in df_mart[['currency', 'side']].drop_duplicates().itertuples(index=False):
+            model, meta = registry.latest('all', currency, side, features)
+            if model is None:
+                raise FileNotFoundError(f'No valid model {currency} {side} with features {features} in {registry.REGISTRY_DIR}')
+            logging.info(f" :::   Model {currency} {side} trained {meta.get('trained_at')} up to {meta.get('watermark')}")
+            models[(currency, side)] = (model, f"{features}/{meta['watermark']}")
 
-    predictions = round(model.predict(X_test)[0][0], 4)
-    logging.info(f" :::   Predictions: {predictions}")
+    with Stage('predict.infer'):
+        df_predict = forecast.predict_latest(models, df_mart, columns, horizons)
+        count_rows(rows_out=len(df_predict))
+    logging.info(f" :::   Predictions: {len(df_predict)} rows")
 
-    with engine.connect() as conn:
-        query = f"UPDATE myfin_dm.myfin_by_for_model SET y_predict = {predictions} where date_page = '{date_page}'"
-        logging.info(query)
-        conn.exec_driver_sql(query)
-        conn.commit()
+    with engine.begin() as conn:
+        conn.exec_driver_sql(load_sql('myfin_dm_predict_ddl'))
+        forecast.write_predictions(conn, df_predict)
 
     logging.info(f" :::   Predictions write to DB")
-except Exception as e:
-    logging.error(e)
\ No newline at end of file
+    count_rows(rows_out=len(df_predict))
+    return df_predict
+
+
+if __name__ == '__main__':
+    # add write logging to file
+    logging.basicConfig(
+        level=logging.INFO,
+        filename="../logs/logs_analytics.log",
+        filemode="a",
+        format="%(asctime)s: %(levelname)s: %(message)s"
+    )
+    logging.info('----------------------------------------------')
+
+    try:
+        main()
+    except Exception as e:
+        logging.error(e)
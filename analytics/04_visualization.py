@@ -2,61 +2,78 @@ import pandas as pd
 import numpy as np
 import psycopg2
 import os
+import hashlib
+import shutil
+import time
+import plotly
 import plotly.express as px
 import plotly.graph_objects as go
+import plotly.io as pio
 import logging
 
-from datetime import datetime, timedelta, date
-from sqlalchemy import create_engine
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta, date
 from omegaconf import OmegaConf
 
+import paths  # the repository root on sys.path for zion17
+from db import read_sql
+from features import streak_length
+from snapshot import filter_frame, read_table
+from zion17.metrics import Stage, count_rows
 
-# add write logging to file
-logging.basicConfig(
-    level=logging.INFO,
-    filename="../logs/logs_analytics.log",
-    filemode="a",
-    format="%(asctime)s: %(levelname)s: %(message)s"
-)
-logging.info('----------------------------------------------')
-folder_name = date.today().strftime('%Y-%m-%d')
 
-if not os.path.exists(f'./report/{folder_name}'):
-    os.makedirs(f'./report/{folder_name}')
-    logging.info(f"Папка {folder_name} успешно создана")
-else:
-    logging.info(f"Папка {folder_name} уже существует")
+def dynamics_frame(df_series):
+    """
+    Последний год ряда со скользящими средними и их пересечениями
+        Окно отсчитывается от последней даты ряда, без новых курсов данные графиков не меняются
+    Args:
+        df_series (pandas dataframe): Ряд из витрины
+    Returns:
+        pandas dataframe
+    """
+    df = df_series.loc[df_series['date_page'] >= df_series['date_page'].max() - pd.DateOffset(years=1)].reset_index(drop=True)
+    df = pd.DataFrame({
+        'date_page': df['date_page'],
+        'bank_name': df['bank_name'],
+        'price_value': df['price_value'],
+        'mean_14': df['mean_14'],
+        'mean_28': df['mean_28'],
+        'is_14_above_28': (df['mean_14'] > df['mean_28']).astype(int),
+        'is_28_above_14': (df['mean_28'] > df['mean_14']).astype(int),
+        'abs_distance_btw_14_28': ((df['mean_14'] - df['mean_28']) / df['price_value'] * 100).abs(),
+        'is_14_up': (df['mean_14'].diff() > 0).astype(int),
+        'is_28_up': (df['mean_28'].diff() > 0).astype(int),
+        })
+    df['cnt_is_14_up'] = streak_length(df['is_14_up'] == 1)
+    df['cnt_is_28_up'] = streak_length(df['is_28_up'] == 1)
+    return df
 
 
-try:
-    conf = OmegaConf.load('/home/tests/tests/vscode/myfin_by_analize/conf/server/db/postgres.yaml')
-    engine = create_engine(
-        f"postgresql+psycopg2://{conf.postgres.user}:{conf.postgres.password}@{conf.postgres.host}:{conf.postgres.port}/{conf.postgres.dbname}"
-        )
-
-    logging.info(" :::   Read dynamics data")
-    bank = 'nbrb'
-    with open('./sql/myfin_dm_read_for_viz_dynamics.sql', 'r') as query:
-        df = pd.read_sql_query(query.read(), engine.connect(), parse_dates={'date_page':'%Y-%m-%d'})
-    engine.connect().close()
-
-    df_dynamics_show = df[['date_page', 'price_value_usd_sell', 'mean_14_price_usd_sell', 'mean_28_price_usd_sell']].set_index('date_page').copy()
+def dynamics_figures(df, windows):
+    """
+    Графики динамики курса со скользящими 14 и 28 на разных окнах
+    Returns:
+        list: (имя графика, figure) по окну
+    """
+    figures = []
+    bank = df['bank_name'].iloc[-1]
+    df_dynamics_show = df[['date_page', 'price_value', 'mean_14', 'mean_28']].set_index('date_page').copy()
 
     # we draw the price dynamics on different windows
-    for days in [365, 180, 90, 60]:
+    for days in windows:
         end_dt = df_dynamics_show.index.max()
         start_dt = end_dt - timedelta(days=days)
         df_dynamics_show = df_dynamics_show[f"{start_dt}":f"{end_dt}"]
 
         fig_dynamics = px.line(
             df_dynamics_show,
-            x = df_dynamics_show.index, y = 'price_value_usd_sell',
+            x = df_dynamics_show.index, y = 'price_value',
             labels = {
-                'price_value_usd_sell': f'',
+                'price_value': f'',
                 'date_page': ''}
         )
-        fig_dynamics.add_scatter(x=df_dynamics_show.index.get_level_values(0), y=df_dynamics_show['mean_14_price_usd_sell'], mode='lines')
-        fig_dynamics.add_scatter(x=df_dynamics_show.index.get_level_values(0), y=df_dynamics_show['mean_28_price_usd_sell'], mode='lines')
+        fig_dynamics.add_scatter(x=df_dynamics_show.index.get_level_values(0), y=df_dynamics_show['mean_14'], mode='lines')
+        fig_dynamics.add_scatter(x=df_dynamics_show.index.get_level_values(0), y=df_dynamics_show['mean_28'], mode='lines')
 
         fig_dynamics.update_layout(
             showlegend=False,
@@ -71,7 +88,7 @@ try:
             dtick='M1', showgrid = False
             # rangeslider_visible=True
             )
-        
+
         fig_dynamics.update_yaxes(
             showgrid = False
             )
@@ -79,10 +96,16 @@ try:
             fig_dynamics.update_xaxes(
                 dtick='D1', showgrid = False
                 )
-        
-        file_name = f"./report/{folder_name}/{len(os.listdir(f'./report/{folder_name}'))}.png"
-        fig_dynamics.write_image(f'{file_name}')
+        figures.append((f'dynamics_{days}', fig_dynamics))
+    return figures
 
+
+def cards_figure(df, df_series, bank, currency, y_predict):
+    """
+    Карточки со статистикой ряда и прогнозом на следующий день
+    Returns:
+        tuple: ('cards', figure)
+    """
     # calculating statistics for cards
     sma_up = 14 if df['is_14_above_28'].values[-1] == 1 else 28
     sma_14_is_up = 1 if df['is_14_up'].values[-1] == 1 else -1
@@ -101,52 +124,23 @@ try:
             intersect_index = len(intersect_list) - index - 1
             break
     intersect_dt = df.iloc[intersect_index, 0]
-    intersect_day_ago = (datetime.today() - intersect_dt).days
-
-    df_dynamics_sma_distance = df.loc[df['date_page'] >= datetime.today() - timedelta(days=14)][['date_page', 'abs_distance_btw_14_28']].set_index('date_page').copy()
-
-    def count_up(df, col_name):
-        """
-        Функция считает количество строк равных 1
-            Таким образом можно вычислить величину серии дней, когда скользящая растет
-        Args:
-            df (pandas dataframe): Датафрейм
-            col_name (string): Имя столбца, чтоб считать по разным столбцам
-        Returns:
-            pandas dataframe: Датафрейм с новым полем
-        """
-        cnt_up = 0
-        result = []
-        for idx, row in df.iterrows():
-            if row[f'{col_name}'] == 1:
-                cnt_up += 1
-            elif row[f'{col_name}'] == 0 and cnt_up > 0:
-                cnt_up = 0
-            result.append(cnt_up)
-        
-        df[f'cnt_{col_name}'] = result
-        return df[[f'cnt_{col_name}']]
-
-    df = pd.concat([df, count_up(df[['date_page', 'is_14_up']], 'is_14_up')], axis=1)
-    df = pd.concat([df, count_up(df[['date_page', 'is_28_up']], 'is_28_up')], axis=1)
+    # from the last date of the series: a day without new rates gives the same report
+    intersect_day_ago = (df['date_page'].iloc[-1] - intersect_dt).days
+
     cnt_day_up_14 = df['cnt_is_14_up'].values[-1]
     cnt_day_up_28 = df['cnt_is_28_up'].values[-1]
 
-    logging.info(" :::   Read last data")
-    with open('./sql/myfin_dm_read_for_viz_cards.sql', 'r') as query:
-        df = pd.read_sql_query(query.read(), engine.connect(), parse_dates={'date_page':'%Y-%m-%d'}).iloc[0:1]
-
-    date_yesterday = df.iloc[:, 0][0].strftime('%Y-%m-%d')
-    bank_name = df.iloc[:, 1][0]
-    price_value_usd_sell = df.iloc[:, 2][0]
-    price_value_usd_sell_1_day = df.iloc[:, 3][0]
-    price_value_usd_sell_7_day = df.iloc[:, 4][0]
-    price_value_usd_sell_30_day = df.iloc[:, 5][0]
-    price_value_usd_sell_90_day = df.iloc[:, 6][0]
-    price_value_usd_sell_365_day = df.iloc[:, 7][0]
-    cnt_up = df.iloc[:, 8][0]
-    cnt_down = df.iloc[:, 9][0]
-    y_predict = float(df.iloc[:, 10][0])
+    price_value = df_series['price_value']
+
+    date_yesterday = df_series['date_page'].iloc[-1].strftime('%Y-%m-%d')
+    price_value_last = price_value.iloc[-1]
+    price_value_1_day = price_value.shift(1).iloc[-1]
+    price_value_7_day = price_value.shift(7).iloc[-1]
+    price_value_30_day = price_value.shift(30).iloc[-1]
+    price_value_90_day = price_value.shift(90).iloc[-1]
+    price_value_365_day = price_value.shift(365).iloc[-1]
+    cnt_up = df_series['cnt_up'].iloc[-1]
+    cnt_down = df_series['cnt_down'].iloc[-1]
 
     # cards viz
     fig_cards = go.Figure()
@@ -154,7 +148,7 @@ try:
     # Текущий курс валюты
     fig_cards.add_trace(go.Indicator(
         mode = 'number',
-        value = price_value_usd_sell,
+        value = price_value_last,
         number = {'valueformat': '.3f'},
         domain = {'row': 0, 'column': 0}
         )
@@ -191,8 +185,8 @@ try:
     fig_cards.add_trace(go.Indicator(
         title = {'text': '1 day'},
         mode = 'delta',
-        value = price_value_usd_sell,
-        delta = {'position': 'top', 'reference': price_value_usd_sell_1_day, 'relative': True, 'valueformat': '.2%'},
+        value = price_value_last,
+        delta = {'position': 'top', 'reference': price_value_1_day, 'relative': True, 'valueformat': '.2%'},
         domain = {'row': 0, 'column': 1}
         )
     )
@@ -200,8 +194,8 @@ try:
     fig_cards.add_trace(go.Indicator(
         title = {'text': '7 day'},
         mode = 'delta',
-        value = price_value_usd_sell,
-        delta = {'position': 'top', 'reference': price_value_usd_sell_7_day, 'relative': True, 'valueformat': '.2%'},
+        value = price_value_last,
+        delta = {'position': 'top', 'reference': price_value_7_day, 'relative': True, 'valueformat': '.2%'},
         domain = {'row': 1, 'column': 1}
         )
     )
@@ -209,8 +203,8 @@ try:
     fig_cards.add_trace(go.Indicator(
         title = {'text': '30 day'},
         mode = 'delta',
-        value = price_value_usd_sell,
-        delta = {'position': 'top', 'reference': price_value_usd_sell_30_day, 'relative': True, 'valueformat': '.2%'},
+        value = price_value_last,
+        delta = {'position': 'top', 'reference': price_value_30_day, 'relative': True, 'valueformat': '.2%'},
         domain = {'row': 2, 'column': 1}
         )
     )
@@ -218,8 +212,8 @@ try:
     fig_cards.add_trace(go.Indicator(
         title = {'text': '90 day'},
         mode = 'delta',
-        value = price_value_usd_sell,
-        delta = {'position': 'top', 'reference': price_value_usd_sell_90_day, 'relative': True, 'valueformat': '.2%'},
+        value = price_value_last,
+        delta = {'position': 'top', 'reference': price_value_90_day, 'relative': True, 'valueformat': '.2%'},
         domain = {'row': 3, 'column': 1}
         )
     )
@@ -227,8 +221,8 @@ try:
     fig_cards.add_trace(go.Indicator(
         title = {'text': '365 day'},
         mode = 'delta',
-        value = price_value_usd_sell,
-        delta = {'position': 'top', 'reference': price_value_usd_sell_365_day, 'relative': True, 'valueformat': '.2%'},
+        value = price_value_last,
+        delta = {'position': 'top', 'reference': price_value_365_day, 'relative': True, 'valueformat': '.2%'},
         domain = {'row': 4, 'column': 1}
         )
     )
@@ -270,7 +264,7 @@ try:
     )
     # UPDATE LAYOUT
     fig_cards.update_layout(
-        title=f'{date_yesterday} USD',
+        title=f'{date_yesterday} {currency.upper()}',
         grid = {'rows': 5, 'columns': 3, 'pattern': 'independent'},
         autosize=False,
         width=650, height=500,
@@ -278,8 +272,17 @@ try:
         plot_bgcolor='#f1f1f1',
         margin={'r': 25, 't': 50, 'l': 25, 'b': 10}
     )
-    file_name = f"./report/{folder_name}/{len(os.listdir(f'./report/{folder_name}'))}.png"
-    fig_cards.write_image(f'{file_name}')
+    return 'cards', fig_cards
+
+
+def sma_distance_figure(df):
+    """
+    Дистанция между SMA 14 и 28 за последние две недели
+    Returns:
+        tuple: ('sma_distance', figure)
+    """
+    bank = df['bank_name'].iloc[-1]
+    df_dynamics_sma_distance = df.loc[df['date_page'] >= df['date_page'].max() - timedelta(days=14)][['date_page', 'abs_distance_btw_14_28']].set_index('date_page').copy()
 
     # dynamics sma distance
     fig_sma_distance = px.area(
@@ -304,9 +307,167 @@ try:
     fig_sma_distance.update_yaxes(
         showgrid = False
         )
-    file_name = f"./report/{folder_name}/{len(os.listdir(f'./report/{folder_name}'))}.png"
-    fig_sma_distance.write_image(f'{file_name}')
+    return 'sma_distance', fig_sma_distance
+
+
+def next_day_predict(df_predict, bank, currency, side):
+    # the next day forecast made from the last row of the series
+    series = dict(bank_name=bank, currency=currency, side=side)
+    if df_predict is None:
+        df_predict = read_sql('myfin_dm_read_predict', series)
+    df_predict = df_predict.loc[
+        (df_predict[list(series)] == pd.Series(series)).all(axis=1) & (df_predict['horizon'] == 1)
+        ].sort_values('date_page')
+    return float(df_predict['y_predict'].iloc[-1]) if len(df_predict) else np.nan
+
+
+def report_figures(conf_viz, df_series, df_predict, report):
+    """
+    Все графики отчета одного ряда, без экспорта
+    Returns:
+        list: (имя графика, figure) в порядке отправки
+    """
+    bank, currency, side = report.bank_name, report.currency, report.side
+    df = dynamics_frame(df_series)
+    y_predict = next_day_predict(df_predict, bank, currency, side)
+    return [
+        *dynamics_figures(df, conf_viz.windows),
+        cards_figure(df, df_series, bank, currency, y_predict),
+        sma_distance_figure(df),
+    ]
+
+
+def export_image(spec):
+    # kaleido keeps its renderer process alive between calls of one python process
+    file_name, fig = spec
+    pio.write_image(fig, file_name)
+    return file_name
+
+
+def figure_key(fig):
+    # the data slice and the layout are both in the figure json
+    payload = f'{plotly.__version__}\n{fig.to_json()}'
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+def from_cache(specs, cache_dir):
+    """
+    Копирование из кеша картинок, чьи графики не изменились
+    Args:
+        specs (list): (путь файла, figure как dict, хеш figure)
+        cache_dir (string): Папка кеша, <хеш>.png
+    Returns:
+        list: Спеки без картинки в кеше
+    """
+    missing = []
+    for file_name, fig, key in specs:
+        cached = f'{cache_dir}/{key}.png'
+        if os.path.exists(cached):
+            shutil.copyfile(cached, file_name)
+            # the mtime is the last use, old entries are pruned by it
+            os.utime(cached)
+        else:
+            missing.append((file_name, fig, key))
+    return missing
+
+
+def to_cache(specs, cache_dir, keep_days):
+    os.makedirs(cache_dir, exist_ok=True)
+    for file_name, _, key in specs:
+        tmp = f'{cache_dir}/{key}.png.tmp'
+        shutil.copyfile(file_name, tmp)
+        os.replace(tmp, f'{cache_dir}/{key}.png')
+
+    expired = time.time() - keep_days * 24 * 3600
+    for entry in os.scandir(cache_dir):
+        if entry.stat().st_mtime < expired:
+            os.remove(entry.path)
+
+
+def render(specs, n_jobs):
+    """
+    Экспорт всех графиков в png
+        С n_jobs > 1 графики делятся между процессами, у каждого свой kaleido
+    Args:
+        specs (list): (путь файла, figure как dict)
+        n_jobs (int): Процессы экспорта, 1 - в текущем процессе
+    Returns:
+        list: Пути записанных файлов
+    """
+    if n_jobs <= 1 or len(specs) <= 1:
+        return [export_image(spec) for spec in specs]
+    with ProcessPoolExecutor(max_workers=min(n_jobs, len(specs))) as executor:
+        return list(executor.map(export_image, specs, chunksize=-(-len(specs) // n_jobs)))
+
+
+@Stage('viz')
+def main(df_mart=None, df_predict=None):
+    """
+    Графики динамики курса и карточки со статистикой в ./report/{сегодня}
+        по отчету на каждый ряд из conf/analytics/viz.yaml
+    Args:
+        df_mart (pandas dataframe): Витрина, если уже прочитана
+        df_predict (pandas dataframe): Прогнозы 03_predict, по умолчанию из myfin_dm.myfin_by_predict
+    Returns:
+        int: Количество картинок
+    """
+    conf_viz = OmegaConf.load('../conf/analytics/viz.yaml').viz
+    folder_name = date.today().strftime('%Y-%m-%d')
+
+    if not os.path.exists(f'./report/{folder_name}'):
+        os.makedirs(f'./report/{folder_name}')
+        logging.info(f"Папка {folder_name} успешно создана")
+    else:
+        logging.info(f"Папка {folder_name} уже существует")
+
+    logging.info(" :::   Read dynamics data")
+    if df_mart is None:
+        df_mart = read_table('mart', filters=[('bank_name', 'in', sorted({report.bank_name for report in conf_viz.reports}))])
+
+    cache_dir = './report/.cache'
+
+    logging.info(" :::   Build figures")
+    specs = []
+    for report in conf_viz.reports:
+        df_series = filter_frame(df_mart, [('bank_name', '=', report.bank_name), ('currency', '=', report.currency), ('side', '=', report.side)])
+        if df_series.empty:
+            logging.warning(f" :::   No data for {report.bank_name} {report.currency} {report.side}")
+            continue
+        count_rows(rows_in=len(df_series))
+        for chart, fig in report_figures(conf_viz, df_series, df_predict, report):
+            # the index keeps the sending order, the name does not depend on the folder contents
+            file_name = f"./report/{folder_name}/{len(specs):02d}_{report.bank_name}_{report.currency}_{chart}.png"
+            specs.append((file_name, fig.to_dict(), figure_key(fig)))
+
+    # the images of a previous run with other reports are not sent
+    for file_name in set(os.listdir(f'./report/{folder_name}')) - {os.path.basename(spec[0]) for spec in specs}:
+        if file_name.endswith('.png'):
+            os.remove(f'./report/{folder_name}/{file_name}')
+
+    missing = from_cache(specs, cache_dir) if conf_viz.cache.enabled else specs
+    logging.info(f" :::   {len(specs) - len(missing)} img's from cache, {len(missing)} to render")
+
+    with Stage('viz.export'):
+        render([(file_name, fig) for file_name, fig, _ in missing], conf_viz.n_jobs)
+        count_rows(rows_out=len(missing))
+    if conf_viz.cache.enabled:
+        to_cache(missing, cache_dir, conf_viz.cache.keep_days)
+
+    logging.info(f" :::   Save {len(specs)} img's to {folder_name}")
+    return len(specs)
+
+
+if __name__ == '__main__':
+    # add write logging to file
+    logging.basicConfig(
+        level=logging.INFO,
+        filename="../logs/logs_analytics.log",
+        filemode="a",
+        format="%(asctime)s: %(levelname)s: %(message)s"
+    )
+    logging.info('----------------------------------------------')
 
-    logging.info(f" :::   Save img's to {folder_name}")
-except Exception as e:
-    logging.error(e)
+    try:
+        main()
+    except Exception as e:
+        logging.error(e)
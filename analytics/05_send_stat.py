@@ -6,47 +6,61 @@ from datetime import date
 import time
 from pathlib import Path
 
+import paths  # the repository root on sys.path for zion17
+from zion17.metrics import Stage, count_rows
 
-# add write logging to file
-logging.basicConfig(
-    level=logging.INFO,
-    filename="../logs/logs_analytics.log",
-    filemode="a",
-    format="%(asctime)s: %(levelname)s: %(message)s"
-)
-logging.info('----------------------------------------------')
-
-try:
-    conf = OmegaConf.load('../conf/server/telegram/telegram.yaml')
 
+def send_message_tg(conf, message):
     token = conf.telegram.token
     chat_id = conf.telegram.chat_id
-    folder_name = date.today().strftime('%Y-%m-%d')
+    bot = telebot.TeleBot(token=token)
+    bot.send_message(chat_id=chat_id, text=message)
 
+    return True
 
-    def send_message_tg(message):
-        token = conf.telegram.token
-        chat_id = conf.telegram.chat_id
-        bot = telebot.TeleBot(token=token)
-        bot.send_message(chat_id=chat_id, text=message)
 
-        return True
+def send_picture_tg(conf, path_photo):
+    token = conf.telegram.token
+    chat_id = conf.telegram.chat_id
+    bot = telebot.TeleBot(token=token)
+    with open(path_photo, 'rb') as f:
+        bot.send_photo(chat_id=chat_id, photo=f)
+
+    return True
 
 
-    def send_picture_tg(path_photo):
-        token = conf.telegram.token
-        chat_id = conf.telegram.chat_id
-        bot = telebot.TeleBot(token=token)
-        with open(path_photo, 'rb') as f:
-            bot.send_photo(chat_id=chat_id, photo=f)
+@Stage('send')
+def main():
+    """
+    Отправка картинок отчета ./report/{сегодня} в телеграм
+    Returns:
+        int: Количество отправленных картинок
+    """
+    conf = OmegaConf.load('../conf/server/telegram/telegram.yaml')
 
-        return True
+    folder_name = date.today().strftime('%Y-%m-%d')
 
-    for fl in sorted(os.listdir(f'./report/{folder_name}')):
+    files = sorted(os.listdir(f'./report/{folder_name}'))
+    for fl in files:
         path_img = os.path.dirname(os.path.abspath(__file__)) + f'/report/{folder_name}/{fl}'
-        send_picture_tg(path_img)
+        send_picture_tg(conf, path_img)
         time.sleep(0.3)
         logging.info(f'{path_img} send')
+    count_rows(rows_out=len(files))
+    return len(files)
+
+
+if __name__ == '__main__':
+    # add write logging to file
+    logging.basicConfig(
+        level=logging.INFO,
+        filename="../logs/logs_analytics.log",
+        filemode="a",
+        format="%(asctime)s: %(levelname)s: %(message)s"
+    )
+    logging.info('----------------------------------------------')
 
-except Exception as e:
-    logging.error(e)
+    try:
+        main()
+    except Exception as e:
+        logging.error(e)
@@ -0,0 +1,163 @@
+# Walk-forward backtest of the candidate models from conf/analytics/model.yaml
+#
+# The feature matrix and the fold bounds are built once, every
+# (candidate, fold) pair is an independent joblib task reading the same
+# memory-mapped matrix. A candidate is an estimator with a subset of the
+# feature columns, it is scored by MAE, RMSE and directional accuracy (the
+# sign of the predicted move against the price of the day, over the rows where
+# the price did move: a flat day, common for NBRB on weekends and holidays,
+# has no direction to guess). The winner is
+# refitted on all rows. The target may have several columns (the forecast
+# horizons), the metrics are averaged over them.
+
+import logging
+import time
+from fnmatch import fnmatch
+
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from omegaconf import OmegaConf
+from sklearn.compose import ColumnTransformer
+from sklearn.linear_model import LinearRegression, Ridge, SGDRegressor
+from sklearn.model_selection import TimeSeriesSplit
+from sklearn.multioutput import MultiOutputRegressor
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+
+# lower is better for the errors, higher for the share of guessed directions
+METRICS_ASCENDING = {'mae': True, 'rmse': True, 'direction': False}
+
+
+def make_regressor(estimator, conf_model, params=None):
+    params = params or {}
+    if estimator == 'sgd':
+        # one SGDRegressor per horizon, partial_fit stays available
+        return MultiOutputRegressor(SGDRegressor(
+            alpha=params.get('alpha', conf_model.sgd.alpha),
+            eta0=conf_model.sgd.eta0,
+            learning_rate=conf_model.sgd.learning_rate,
+            max_iter=conf_model.sgd.max_iter,
+            random_state=17,
+        ))
+    if estimator == 'ridge':
+        return Ridge(alpha=params.get('alpha', 1.0))
+    return LinearRegression()
+
+
+def make_pipeline(estimator, conf_model, columns=None, params=None):
+    """
+    Пайплайн модели: [выбор столбцов] -> StandardScaler -> регрессор
+        С columns модель сама выбирает свои признаки из всех столбцов витрины
+    Args:
+        estimator (string): linear, ridge или sgd
+        conf_model (omegaconf): Настройки модели
+        columns (list): Подмножество признаков, None - все
+        params (dict): Параметры кандидата (alpha)
+    Returns:
+        sklearn pipeline
+    """
+    tasks = []
+    if columns is not None:
+        tasks.append(('select', ColumnTransformer([('features', 'passthrough', list(columns))])))
+    tasks += [
+        ('scaler', StandardScaler()),
+        ('classifier', make_regressor(estimator, conf_model, params))
+    ]
+    return Pipeline(tasks)
+
+
+def candidate_columns(candidate, columns):
+    patterns = candidate.get('features', 'all')
+    if patterns == 'all':
+        return list(columns)
+    return [column for column in columns if any(fnmatch(column, pattern) for pattern in patterns)]
+
+
+def evaluate_fold(candidate, conf_model, X, y, base, columns_index, train_index, test_index):
+    # X, y and base are memory-mapped by joblib, the fold is sliced in the worker
+    model = make_pipeline(candidate['estimator'], conf_model, params=candidate)
+    X_train, X_test = X[train_index][:, columns_index], X[test_index][:, columns_index]
+
+    started = time.perf_counter()
+    model.fit(X_train, y[train_index])
+    fit_seconds = time.perf_counter() - started
+
+    y_pred = model.predict(X_test).reshape(len(test_index), -1)
+    errors = y_pred - y[test_index]
+    base_test = base[test_index][:, None]
+    direction = np.sign(y_pred - base_test) == np.sign(y[test_index] - base_test)
+    # a flat day would count as a hit only for an exactly flat prediction
+    moved = y[test_index] != base_test
+    return {
+        'candidate': candidate['name'],
+        'fold': int(test_index[0]),
+        'mae': float(np.abs(errors).mean()),
+        'rmse': float(np.sqrt((errors ** 2).mean())),
+        'direction': float(direction[moved].mean()) if moved.any() else np.nan,
+        'fit_seconds': fit_seconds,
+    }
+
+
+def run_backtest(conf_model, df_X, df_y, base, gap=0):
+    """
+    Оценка всех кандидатов на walk-forward фолдах параллельно
+    Args:
+        conf_model (omegaconf): Настройки модели с секцией backtest
+        df_X (pandas dataframe): Все признаки, строки по возрастанию даты
+        df_y (pandas dataframe): Целевая переменная, столбец на горизонт
+        base (pandas series): Цена дня строки, от нее считается направление
+        gap (int): Строк между train и test, чтобы цели train не заходили в test
+    Returns:
+        pandas dataframe: Метрики кандидатов, лучший первым
+    """
+    conf_backtest = conf_model.backtest
+    candidates = OmegaConf.to_container(conf_backtest.candidates)
+    columns = list(df_X.columns)
+
+    X = df_X.to_numpy(dtype='float64')
+    y = df_y.to_numpy(dtype='float64').reshape(len(df_y), -1)
+    base = base.to_numpy(dtype='float64')
+    folds = list(TimeSeriesSplit(n_splits=conf_backtest.n_splits, gap=gap).split(X))
+    tasks = []
+    for candidate in candidates:
+        columns_index = [columns.index(column) for column in candidate_columns(candidate, columns)]
+        for train_index, test_index in folds:
+            tasks.append((candidate, columns_index, train_index, test_index))
+
+    started = time.perf_counter()
+    results = Parallel(n_jobs=conf_backtest.n_jobs)(
+        delayed(evaluate_fold)(candidate, conf_model, X, y, base, columns_index, train_index, test_index)
+        for candidate, columns_index, train_index, test_index in tasks
+    )
+    logging.info(f" :::   Backtest: {len(candidates)} candidates x {len(folds)} folds in {time.perf_counter() - started:.2f}s")
+
+    metric = conf_backtest.metric
+    report = (
+        pd.DataFrame(results)
+        .groupby('candidate', sort=False)
+        .agg(mae=('mae', 'mean'), rmse=('rmse', 'mean'), direction=('direction', 'mean'), fit_seconds=('fit_seconds', 'sum'))
+        .sort_values(metric, ascending=METRICS_ASCENDING[metric])
+    )
+    for name, row in report.iterrows():
+        logging.info(
+            f" :::       {name:<16} MAE {row['mae']:.5f}, RMSE {row['rmse']:.5f}, "
+            f"direction {row['direction']:.3f}, fit {row['fit_seconds']:.3f}s"
+        )
+    return report
+
+
+def select_model(conf_model, df_X, df_y, base, gap=0):
+    """
+    Бэктест кандидатов и обучение победителя на всех строках
+    Returns:
+        tuple: Модель, метрики победителя (dict), отчет по всем кандидатам (dict)
+    """
+    report = run_backtest(conf_model, df_X, df_y, base, gap)
+    winner = report.index[0]
+    candidate = next(c for c in OmegaConf.to_container(conf_model.backtest.candidates) if c['name'] == winner)
+    logging.info(f" :::   Backtest winner: {winner}, refit on {len(df_X)} rows")
+
+    model = make_pipeline(candidate['estimator'], conf_model, candidate_columns(candidate, df_X.columns), candidate)
+    model.fit(df_X, df_y.to_numpy(dtype='float64'))
+    return model, {'candidate': winner, **report.loc[winner].round(6).to_dict()}, report.round(6).to_dict('index')
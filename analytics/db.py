@@ -0,0 +1,162 @@
+# Shared database helpers for the analytics scripts
+#
+# One pooled engine per process, queries from ./sql are read through named
+# server-side cursors in chunks, the column types follow the postgres types
+# of the result
+
+import io
+import logging
+import time
+from functools import lru_cache
+from pathlib import Path
+
+import pandas as pd
+from omegaconf import OmegaConf
+from sqlalchemy import create_engine, event
+
+from paths import ROOT_DIR
+from zion17.metrics import add_db_time
+
+SQL_DIR = Path(__file__).resolve().parent / 'sql'
+
+# postgres type oid of a result column -> pandas dtype, text and the rest stay as read
+PG_DTYPES = {
+    16: 'boolean',
+    20: 'Int64', 21: 'Int64', 23: 'Int64',
+    700: 'float64', 701: 'float64', 1700: 'float64',
+    1082: 'datetime64[ns]', 1114: 'datetime64[ns]',
+}
+
+
+@lru_cache(maxsize=None)
+def get_engine():
+    conf = OmegaConf.load(ROOT_DIR / 'conf/server/db/postgres.yaml')
+    engine = create_engine(
+        f"postgresql+psycopg2://{conf.postgres.user}:{conf.postgres.password}@{conf.postgres.host}:{conf.postgres.port}/{conf.postgres.dbname}",
+        pool_size=5,
+        pool_pre_ping=True,
+        )
+
+    # query durations go to the running zion17.metrics stages
+    @event.listens_for(engine, 'before_cursor_execute')
+    def query_started(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def query_finished(conn, cursor, statement, parameters, context, executemany):
+        add_db_time(time.perf_counter() - conn.info['query_started'].pop())
+
+    return engine
+
+
+def load_sql(name):
+    return (SQL_DIR / f'{name}.sql').read_text()
+
+
+def result_dtypes(description):
+    return {column.name: PG_DTYPES.get(column.type_code) for column in description}
+
+
+def with_dtypes(rows, dtypes):
+    """
+    Датафрейм из строк результата с типами столбцов по их типам в postgres
+        Часть, где столбец целиком NULL, получает тот же тип, что и остальные
+    Args:
+        rows (list): Строки результата
+        dtypes (dict): Столбец -> pandas dtype или None (как прочитан)
+    Returns:
+        pandas dataframe
+    """
+    df = pd.DataFrame.from_records(rows, columns=list(dtypes))
+    for column, dtype in dtypes.items():
+        if dtype == 'datetime64[ns]':
+            df[column] = pd.to_datetime(df[column]).astype(dtype)
+        elif dtype is not None:
+            df[column] = df[column].astype(dtype)
+    return df
+
+
+def iter_query(query, params=None, chunksize=10000):
+    """
+    Результат запроса частями по chunksize строк
+        stream_results включает именованный серверный курсор psycopg2,
+        так что в памяти одновременно только одна часть
+    Args:
+        query (string): Текст запроса
+        params (dict): Параметры запроса в формате %(name)s
+        chunksize (int): Строк в одной части
+    Returns:
+        generator: Датафреймы с типами из with_dtypes, пустой результат - одна пустая часть
+    """
+    with get_engine().connect().execution_options(stream_results=True, max_row_buffer=chunksize) as conn:
+        result = conn.exec_driver_sql(query, params)
+        dtypes = result_dtypes(result.cursor.description)
+        empty = True
+        while True:
+            # the rows are fetched from the server here, after the query events have fired
+            started = time.perf_counter()
+            rows = result.fetchmany(chunksize)
+            add_db_time(time.perf_counter() - started, queries=0)
+            if not rows:
+                break
+            empty = False
+            yield with_dtypes(rows, dtypes)
+        if empty:
+            yield with_dtypes([], dtypes)
+
+
+def read_query(query, params=None, chunksize=10000):
+    # the whole result in memory, for small results; large ones are iterated with iter_query
+    return pd.concat(iter_query(query, params, chunksize), ignore_index=True)
+
+
+def read_sql(name, params=None, chunksize=10000):
+    # small results only, see read_query
+    return read_query(load_sql(name), params, chunksize)
+
+
+def table_columns(conn, schema, table):
+    query = """
+        SELECT  column_name
+        FROM    information_schema.columns
+        WHERE   table_schema = %(schema)s
+        AND     table_name = %(table)s
+        ORDER BY ordinal_position
+        """
+    return [row[0] for row in conn.exec_driver_sql(query, {'schema': schema, 'table': table})]
+
+
+def copy_frame(conn, df, schema, table, chunksize=50000):
+    """
+    Загрузка датафрейма в таблицу через COPY FROM STDIN частями по chunksize строк
+        Столбцы датафрейма должны совпадать со столбцами таблицы,
+        иначе ValueError - схема не меняется молча вместе с признаками
+    Args:
+        conn (sqlalchemy connection): Соединение, загрузка идет в его транзакции
+        df (pandas dataframe): Данные
+        schema (string): Схема
+        table (string): Таблица
+        chunksize (int): Строк в одном COPY
+    Returns:
+        int: Количество загруженных строк
+    """
+    columns = table_columns(conn, schema, table)
+    missing, extra = set(columns) - set(df.columns), set(df.columns) - set(columns)
+    if missing or extra:
+        raise ValueError(f'{schema}.{table}: missing columns {sorted(missing)}, unknown columns {sorted(extra)}')
+
+    started = time.perf_counter()
+    cursor = conn.connection.cursor()
+    query = f"COPY {schema}.{table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)"
+    for start in range(0, len(df), chunksize):
+        buffer = io.StringIO()
+        # NaN and None become empty fields, which COPY reads as NULL
+        df.iloc[start:start + chunksize][columns].to_csv(buffer, index=False, header=False, date_format='%Y-%m-%d')
+        buffer.seek(0)
+        cursor.copy_expert(query, buffer)
+    cursor.close()
+
+    elapsed = time.perf_counter() - started
+    add_db_time(elapsed)
+    logging.info(f' :::       COPY {schema}.{table}: {len(df)} rows in {elapsed:.2f}s ({len(df) / max(elapsed, 1e-9):.0f} rows/s)')
+    return len(df)
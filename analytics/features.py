@@ -0,0 +1,144 @@
+# Shared feature calculations for the analytics scripts
+
+import numpy as np
+import pandas as pd
+
+
+def streak_length(mask):
+    """
+    Длина текущей серии подряд идущих True для каждой строки
+        [F, T, T, F, T] -> [0, 1, 2, 0, 1]
+        Считается без цикла: номер строки минус номер последней строки с False
+    Args:
+        mask (array-like of bool): Условие, например is_up == 1
+    Returns:
+        numpy array: Длина серии на каждой строке
+    """
+    mask = np.asarray(mask, dtype=bool)
+    idx = np.arange(len(mask))
+    last_false = np.maximum.accumulate(np.where(mask, -1, idx))
+    return np.where(mask, idx - last_false, 0)
+
+
+def rolling_window_stats(values, win, decay=0.9):
+    """
+    Статистики скользящего окна размера win за один проход по окнам
+        Окна - это view на исходный массив (sliding_window_view), без копирования
+        Для строк, где окно еще не заполнено, значение NaN
+    Args:
+        values (array-like): Ряд значений, например цена продажи
+        win (int): Размер окна
+        decay (float): Коэффициент затухания для mean_decay, последнее значение окна имеет вес 1
+    Returns:
+        dict: mean_decay, diff_fl, mean, median, min, max, std -> numpy array той же длины, что values
+    """
+    values = np.asarray(values, dtype=float)
+    names = ('mean_decay', 'diff_fl', 'mean', 'median', 'min', 'max', 'std')
+    stats = {name: np.full(len(values), np.nan) for name in names}
+    if len(values) < win:
+        return stats
+
+    windows = np.lib.stride_tricks.sliding_window_view(values, win)
+    weights = np.power(decay, np.arange(win)[::-1])
+
+    stats['mean_decay'][win - 1:] = windows @ weights
+    # like pandas rolling, a window with a gap inside gives NaN
+    stats['diff_fl'][win - 1:] = np.where(np.isnan(windows).any(axis=1), np.nan, windows[:, 0] - windows[:, -1])
+    stats['mean'][win - 1:] = windows.mean(axis=1)
+    stats['median'][win - 1:] = np.median(windows, axis=1)
+    stats['min'][win - 1:] = windows.min(axis=1)
+    stats['max'][win - 1:] = windows.max(axis=1)
+    stats['std'][win - 1:] = windows.std(axis=1, ddof=1)
+    return stats
+
+
+def history_rows(list_periods):
+    """
+    Строк ряда до даты перезапуска, которых хватает пересчету следующих строк
+        Последняя строка до перезапуска (ей дописывается y) должна иметь
+        заполненным самое большое окно, окна считаются по строкам, а не по дням
+    Args:
+        list_periods (list): Размеры окон
+    Returns:
+        int: Количество строк с датой не позже даты перезапуска
+    """
+    return max(list_periods)
+
+
+def split_series(df, currencies, sides):
+    """
+    Разбивает сырые данные банков на отдельные ряды (банк, валюта, сторона)
+    Args:
+        df (pandas dataframe): Строки myfin_dm.myfin_by_daily: date_page, bank_name,
+            цены price_value_{валюта}_{sell|buy} и спреды bank_spred_{валюта}
+        currencies (list): Валюты, например ['usd', 'eur', 'rub']
+        sides (list): Стороны, ['sell', 'buy']
+    Returns:
+        list: Датафреймы date_page, bank_name, currency, side, price_value, bank_spred
+    """
+    series = []
+    for bank_name, df_bank in df.groupby('bank_name', sort=True):
+        df_bank = df_bank.sort_values('date_page')
+        for currency in currencies:
+            for side in sides:
+                series.append(pd.DataFrame({
+                    'date_page': df_bank['date_page'].values,
+                    'bank_name': bank_name,
+                    'currency': currency,
+                    'side': side,
+                    'price_value': df_bank[f'price_value_{currency}_{side}'].values,
+                    'bank_spred': df_bank[f'bank_spred_{currency}'].values,
+                }))
+    return series
+
+
+def new_features(dataframe, list_periods):
+    """
+    Статистики по окнам для одного ряда, добавляет в dataframe столбец diff_day
+    Args:
+        dataframe (pandas dataframe): Ряд со столбцами price_value и bank_spred
+        list_periods (list): Размеры окон
+    Returns:
+        pandas dataframe: Признаки {статистика}_{окно} с тем же индексом
+    """
+    X = pd.DataFrame(index=dataframe.index)
+    dataframe['diff_day'] = -dataframe['bank_spred'].diff().fillna(0)
+
+    for win in list_periods:
+        stats = rolling_window_stats(dataframe['price_value'].values, win)
+
+        X[f'diff_mean_{win}'] = dataframe['diff_day'].rolling(window=win-1).mean().fillna(0)
+        X[f'mean_decay_{win}'] = stats['mean_decay']
+        X[f'diff_fl_{win}'] = stats['diff_fl']
+        for stat in ['mean', 'median', 'min', 'max', 'std']:
+            X[f'{stat}_{win}'] = np.nan_to_num(stats[stat], nan=0.0)
+
+    return X
+
+
+def series_features(df_series, list_periods):
+    """
+    Строки витрины для одного ряда (банк, валюта, сторона)
+        Строки, где окна еще не заполнены, отбрасываются,
+        y - цена следующего дня, для последней строки пустая
+    Args:
+        df_series (pandas dataframe): Ряд из split_series
+        list_periods (list): Размеры окон
+    Returns:
+        pandas dataframe: Строки витрины myfin_dm.myfin_by_for_model
+    """
+    df_series = df_series.set_index('date_page')
+
+    # we consider a series of price up and down
+    change = df_series['price_value'] - df_series['price_value'].shift(1)
+    df_series['cnt_up'] = streak_length(change > 0)
+    df_series['cnt_down'] = streak_length(change < 0)
+
+    # counting statistics by windows
+    df_new_features = new_features(df_series, list_periods)
+    df_series = pd.concat([df_series, df_new_features], axis=1)
+    df_series.dropna(inplace=True)
+    df_series['y'] = df_series['price_value'].shift(-1)
+    df_series['y_predict'] = None
+
+    return df_series.reset_index()
@@ -0,0 +1,131 @@
+# Multi-horizon forecast for every series of the mart
+#
+# One model per (currency, side) is trained on the rows of all banks, its
+# target has a column per horizon: y_<h> is the price on date_page + h days,
+# missing when the series has no row on that date.
+# Inference takes the last row of every bank and scores it with a single
+# predict call per model, the predictions go to myfin_dm.myfin_by_predict
+# with one bulk upsert.
+
+import logging
+import time
+
+import numpy as np
+import pandas as pd
+from psycopg2.extras import execute_values
+
+from db import add_db_time
+
+SERIES_KEY = ['bank_name', 'currency', 'side']
+
+PREDICT_COLUMNS = (
+    'bank_name',
+    'currency',
+    'side',
+    'date_page',
+    'horizon',
+    'target_date',
+    'y_predict',
+    'model',
+    'latency_ms',
+)
+
+UPSERT_QUERY = f"""
+    insert into myfin_dm.myfin_by_predict ({', '.join(PREDICT_COLUMNS)}, predicted_at)
+    values %s
+    on conflict (bank_name, currency, side, date_page, horizon) do update
+    set ({', '.join(PREDICT_COLUMNS[5:])}, predicted_at)
+        = ({', '.join('excluded.' + c for c in PREDICT_COLUMNS[5:])}, excluded.predicted_at)
+"""
+
+
+def target_columns(horizons):
+    return [f'y_{h}' for h in horizons]
+
+
+def horizon_targets(df, horizons):
+    """
+    Цели на несколько горизонтов: цена ряда на дату date_page + h дней
+        Сдвиг по датам, а не по строкам: в ряду бывают пропущенные дни,
+        нет строки на целевую дату - цель NaN, как и target_date прогноза
+    Args:
+        df (pandas dataframe): Строки витрины одного или нескольких рядов
+        horizons (list): Горизонты в днях
+    Returns:
+        pandas dataframe: Столбцы y_<h> с индексом df
+    """
+    key = SERIES_KEY + ['date_page']
+    prices = df[key + ['price_value']]
+    targets = {}
+    for h in horizons:
+        # the price of date d is the target of the row dated d - h
+        shifted = prices.assign(date_page=prices['date_page'] - pd.Timedelta(days=h))
+        targets[f'y_{h}'] = df[key].merge(shifted, how='left', on=key)['price_value'].to_numpy()
+    return pd.DataFrame(targets, index=df.index)
+
+
+def latest_rows(df):
+    return df.sort_values('date_page').groupby(SERIES_KEY, sort=False).tail(1).reset_index(drop=True)
+
+
+def predict_latest(models, df_mart, columns, horizons):
+    """
+    Прогноз от последней строки каждого ряда, один вызов predict на модель
+    Args:
+        models (dict): (currency, side) -> (модель, имя модели)
+        df_mart (pandas dataframe): Витрина
+        columns (list): Признаки
+        horizons (list): Горизонты в днях
+    Returns:
+        pandas dataframe: Строка на (ряд, горизонт) со столбцами PREDICT_COLUMNS
+    """
+    frames = []
+    for (currency, side), (model, model_name) in models.items():
+        df = latest_rows(df_mart.loc[(df_mart['currency'] == currency) & (df_mart['side'] == side)])
+        if df.empty:
+            continue
+
+        started = time.perf_counter()
+        y_predict = np.asarray(model.predict(df[columns])).reshape(len(df), -1)
+        latency_ms = (time.perf_counter() - started) * 1000
+        logging.info(f' :::       {currency} {side}: {len(df)} series x {len(horizons)} horizons in {latency_ms:.1f} ms')
+
+        for i, horizon in enumerate(horizons):
+            frames.append(pd.DataFrame({
+                'bank_name': df['bank_name'],
+                'currency': currency,
+                'side': side,
+                'date_page': df['date_page'],
+                'horizon': horizon,
+                'target_date': df['date_page'] + pd.Timedelta(days=horizon),
+                'y_predict': y_predict[:, i].round(4),
+                'model': model_name,
+                'latency_ms': round(latency_ms, 3),
+                }))
+    if not frames:
+        return pd.DataFrame(columns=PREDICT_COLUMNS)
+    return pd.concat(frames, ignore_index=True)
+
+
+def write_predictions(conn, df_predict):
+    """
+    Запись прогнозов одним upsert в myfin_dm.myfin_by_predict
+    Args:
+        conn (sqlalchemy connection): Соединение, запись идет в его транзакции
+        df_predict (pandas dataframe): Результат predict_latest
+    Returns:
+        int: Количество записанных строк
+    """
+    if df_predict.empty:
+        return 0
+    rows = [
+        (row.bank_name, row.currency, row.side, row.date_page.date(), int(row.horizon),
+         row.target_date.date(), float(row.y_predict), row.model, float(row.latency_ms))
+        for row in df_predict.itertuples(index=False)
+    ]
+    started = time.perf_counter()
+    cursor = conn.connection.cursor()
+    execute_values(cursor, UPSERT_QUERY, rows, template=f"({', '.join(['%s'] * len(PREDICT_COLUMNS))}, now())", page_size=len(rows))
+    cursor.close()
+    add_db_time(time.perf_counter() - started)
+    return len(rows)
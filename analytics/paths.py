@@ -0,0 +1,14 @@
+# Repository root of the analytics scripts
+#
+# The scripts run from analytics/ (python 01_preparing_data_for_model.py) or
+# are imported by zion17.run, and use the zion17 package of the repository
+# root. This module is the only place that puts the root on sys.path, every
+# script that imports zion17 imports it first.
+
+import sys
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+
+if str(ROOT_DIR) not in sys.path:
+    sys.path.insert(0, str(ROOT_DIR))
@@ -0,0 +1,111 @@
+# Registry of the trained models
+#
+#     models/registry/<bank>_<currency>_<side>/<feature hash>/<watermark>.joblib
+#                                                             <watermark>.json
+#
+# A model is keyed by its series, the hash of the feature columns together
+# with the model settings, and the watermark: the last date_page with a known
+# y it was trained on. Training with the same key reuses the stored model,
+# prediction takes the newest model whose file still loads.
+
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+
+from joblib import dump, load
+
+REGISTRY_DIR = Path(__file__).resolve().parent / 'models' / 'registry'
+
+# mart columns that are not features
+NON_FEATURE_COLUMNS = ['date_page', 'bank_name', 'currency', 'side', 'y', 'y_predict']
+
+
+def feature_columns(df):
+    return [column for column in df.columns if column not in NON_FEATURE_COLUMNS]
+
+
+def feature_hash(columns, params):
+    """
+    Хеш набора признаков и настроек модели
+        Модель с другим хешем нельзя ни переиспользовать, ни дообучать
+    Args:
+        columns (list): Столбцы признаков в порядке подачи в модель
+        params (dict): Настройки модели из conf/analytics/model.yaml
+    Returns:
+        string: 12 символов sha1
+    """
+    payload = json.dumps({'columns': list(columns), 'params': params}, sort_keys=True)
+    return hashlib.sha1(payload.encode()).hexdigest()[:12]
+
+
+def series_dir(bank_name, currency, side):
+    return REGISTRY_DIR / f'{bank_name}_{currency}_{side}'
+
+
+def model_path(bank_name, currency, side, features, watermark):
+    return series_dir(bank_name, currency, side) / features / f'{watermark}.joblib'
+
+
+def save(model, bank_name, currency, side, features, watermark, **meta):
+    path = model_path(bank_name, currency, side, features, watermark)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    meta = {'bank_name': bank_name, 'currency': currency, 'side': side,
+            'feature_hash': features, 'watermark': watermark, **meta}
+    # the sidecar is in place before the model: latest() sees a model only with its metadata
+    tmp = path.with_name(f'.{path.stem}.json.{os.getpid()}.tmp')
+    tmp.write_text(json.dumps(meta, indent=1, default=str))
+    tmp.replace(path.with_suffix('.json'))
+    tmp = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+    dump(model, tmp)
+    tmp.replace(path)
+    logging.info(f' :::   Model saved to {path.relative_to(REGISTRY_DIR)}')
+    return path
+
+
+def load_model(path):
+    try:
+        return load(path)
+    except Exception as e:
+        logging.warning(f' :::   Model {path} is not valid: {e}')
+        return None
+
+
+def read_meta(path):
+    # a model saved before its sidecar existed still has the watermark in its file name
+    meta_path = path.with_suffix('.json')
+    try:
+        meta = json.loads(meta_path.read_text()) if meta_path.exists() else {}
+    except ValueError as e:
+        logging.warning(f' :::   Model metadata {meta_path} is not valid: {e}')
+        meta = {}
+    meta.setdefault('watermark', path.stem)
+    return meta
+
+
+def get(bank_name, currency, side, features, watermark):
+    path = model_path(bank_name, currency, side, features, watermark)
+    return load_model(path) if path.exists() else None
+
+
+def latest(bank_name, currency, side, features=None):
+    """
+    Самая свежая загружаемая модель ряда
+    Args:
+        bank_name, currency, side (string): Ряд
+        features (string): Хеш признаков, None - с любым хешем
+    Returns:
+        tuple: (модель, метаданные) или (None, None)
+    """
+    pattern = f'{features}/*.joblib' if features else '*/*.joblib'
+    candidates = []
+    for path in series_dir(bank_name, currency, side).glob(pattern):
+        meta = read_meta(path)
+        candidates.append((meta['watermark'], meta.get('trained_at', ''), path, meta))
+
+    for _, _, path, meta in sorted(candidates, key=lambda candidate: candidate[:2], reverse=True):
+        model = load_model(path)
+        if model is not None:
+            return model, meta
+    return None, None
@@ -0,0 +1,277 @@
+# Long-lived forecast service
+#
+#     python serve.py                 (from analytics/, settings in conf/analytics/serve.yaml)
+#     curl 'localhost:8017/forecast?bank=nbrb&currency=usd&side=sell'
+#     curl  localhost:8017/metrics
+#
+# The process imports pandas and sklearn once and keeps in memory:
+#   - the models of the registry, an LRU over (currency, side); a model is
+#     reloaded when its registry folder changes (a new watermark was saved);
+#   - the last mart row of every series, re-read from the snapshot every
+#     rows_ttl seconds by a background thread, requests keep the previous rows
+#     until the new ones replace them.
+# A forecast is then a dict lookup and one predict call. /metrics returns the
+# request count and latency percentiles per path, the requests to unknown
+# paths are counted together as 'other'. With a socket path set the
+# service listens on a Unix socket instead of host:port.
+
+import json
+import logging
+import os
+import socketserver
+import threading
+import time
+from collections import OrderedDict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+from omegaconf import OmegaConf
+
+import forecast
+import registry
+from paths import ROOT_DIR
+from snapshot import read_table
+
+conf = OmegaConf.load(ROOT_DIR / 'conf/analytics/serve.yaml').serve
+conf_model = OmegaConf.load(ROOT_DIR / 'conf/analytics/model.yaml').model
+
+
+class NotFoundError(Exception):
+    # no such series or model, answered with 404; a KeyError of a bug stays a 500
+    pass
+
+
+class ModelCache:
+    """
+    LRU моделей registry по (currency, side)
+        Версия модели - время изменения папки ее хеша признаков, новая модель
+        в папке меняет версию и модель перечитывается при следующем запросе
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.models = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, currency, side, features):
+        folder = registry.series_dir('all', currency, side) / features
+        version = folder.stat().st_mtime_ns if folder.exists() else None
+        key = (currency, side, features)
+        with self.lock:
+            cached = self.models.get(key)
+            if cached is not None and cached[0] == version:
+                self.models.move_to_end(key)
+                self.hits += 1
+                return cached[1], cached[2]
+            self.misses += 1
+
+        model, meta = registry.latest('all', currency, side, features)
+        if model is None:
+            raise NotFoundError(f'No valid model {currency} {side} with features {features}')
+        model_name = f"{features}/{meta['watermark']}"
+        logging.info(f' :::   Model {currency} {side} {model_name} loaded')
+        with self.lock:
+            self.models[key] = (version, model, model_name)
+            self.models.move_to_end(key)
+            while len(self.models) > self.size:
+                self.models.popitem(last=False)
+        return model, model_name
+
+
+class LatestRows:
+    """
+    Последние строки всех рядов витрины
+        Фоновый поток перечитывает их раз в ttl секунд и подменяет одним
+        присваиванием кортежа, запросы не ждут чтения снапшота и видят
+        либо старые, либо новые строки целиком
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        # (rows by series, feature columns, feature hash)
+        self.state = None
+        self.lock = threading.Lock()
+
+    def load(self):
+        started = time.perf_counter()
+        rows = forecast.latest_rows(read_table('mart'))
+        columns = registry.feature_columns(rows)
+        features = registry.feature_hash(columns, OmegaConf.to_container(conf_model))
+        by_series = {key: rows.iloc[[i]] for i, key in enumerate(rows[forecast.SERIES_KEY].itertuples(index=False, name=None))}
+        self.state = (by_series, columns, features)
+        logging.info(f' :::   {len(by_series)} latest rows read in {time.perf_counter() - started:.2f}s')
+
+    def refresh(self):
+        while True:
+            time.sleep(self.ttl)
+            try:
+                self.load()
+            except Exception as e:
+                # the previous rows are served until a read succeeds
+                logging.exception(e)
+
+    def start(self):
+        self.load()
+        threading.Thread(target=self.refresh, name='latest-rows', daemon=True).start()
+
+    def get(self):
+        if self.state is None:
+            # before start, the first request reads the rows
+            with self.lock:
+                if self.state is None:
+                    self.load()
+        return self.state
+
+
+class Latency:
+    """
+    Задержки последних window запросов по каждому пути
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.counts = {}
+
+    def add(self, path, status, seconds):
+        with self.lock:
+            self.latencies.setdefault(path, deque(maxlen=self.window)).append(seconds * 1000)
+            counts = self.counts.setdefault(path, {})
+            counts[status] = counts.get(status, 0) + 1
+
+    def report(self):
+        with self.lock:
+            result = {}
+            for path, latencies in self.latencies.items():
+                p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+                result[path] = {
+                    'requests': self.counts[path],
+                    'mean_ms': round(float(np.mean(latencies)), 3),
+                    'p50_ms': round(float(p50), 3),
+                    'p95_ms': round(float(p95), 3),
+                    'p99_ms': round(float(p99), 3),
+                    'max_ms': round(float(np.max(latencies)), 3),
+                }
+            return result
+
+
+# paths with their own latency entry in /metrics
+PATHS = ('/forecast', '/metrics')
+
+models = ModelCache(conf.cache_size)
+latest = LatestRows(conf.rows_ttl)
+latency = Latency(conf.latency_window)
+
+
+def predict(bank_name, currency, side):
+    """
+    Прогноз ряда на горизонты conf/analytics/model.yaml
+    Args:
+        bank_name, currency, side (string): Ряд
+    Returns:
+        dict: Дата последней строки, прогноз по горизонтам и имя модели
+    """
+    rows, columns, features = latest.get()
+    df = rows.get((bank_name, currency, side))
+    if df is None:
+        raise NotFoundError(f'No series {bank_name} {currency} {side} in the mart')
+    model, model_name = models.get(currency, side, features)
+
+    df_predict = forecast.predict_latest({(currency, side): (model, model_name)}, df, columns, list(conf_model.horizons))
+    return {
+        'bank_name': bank_name,
+        'currency': currency,
+        'side': side,
+        'date_page': df['date_page'].iloc[0].strftime('%Y-%m-%d'),
+        'model': model_name,
+        'forecast': [
+            {'horizon': int(row.horizon), 'target_date': row.target_date.strftime('%Y-%m-%d'), 'y_predict': float(row.y_predict)}
+            for row in df_predict.itertuples(index=False)
+        ],
+    }
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        started = time.perf_counter()
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        try:
+            if url.path == '/forecast':
+                missing = [name for name in ('bank', 'currency') if name not in params]
+                if missing:
+                    status, body = 400, {'error': f"Missing parameter {', '.join(missing)}"}
+                else:
+                    status, body = 200, predict(params['bank'], params['currency'], params.get('side', 'sell'))
+            elif url.path == '/metrics':
+                status, body = 200, {
+                    'latency': latency.report(),
+                    'model_cache': {'size': len(models.models), 'hits': models.hits, 'misses': models.misses},
+                }
+            else:
+                status, body = 404, {'error': f'Unknown path {url.path}'}
+        except NotFoundError as e:
+            status, body = 404, {'error': str(e)}
+        except Exception as e:
+            logging.exception(e)
+            status, body = 500, {'error': str(e)}
+
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+        latency.add(url.path if url.path in PATHS else 'other', status, time.perf_counter() - started)
+
+    def address_string(self):
+        # a Unix socket client has no host
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+        logging.debug(f' :::   {self.address_string()} {format % args}')
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        socketserver.UnixStreamServer.server_bind(self)
+        self.server_name, self.server_port = 'unix', 0
+
+
+def make_server():
+    if conf.socket:
+        if os.path.exists(conf.socket):
+            os.remove(conf.socket)
+        return ThreadingUnixHTTPServer(conf.socket, Handler)
+    return ThreadingHTTPServer((conf.host, conf.port), Handler)
+
+
+def main():
+    server = make_server()
+    # the first request should not pay for reading the mart
+    latest.start()
+    logging.info(f" :::   Forecast service on {conf.socket or f'{conf.host}:{conf.port}'}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    # add write logging to file
+    logging.basicConfig(
+        level=logging.INFO,
+        filename="../logs/logs_serve.log",
+        filemode="a",
+        format="%(asctime)s: %(levelname)s: %(message)s"
+    )
+    logging.info('----------------------------------------------')
+
+    main()
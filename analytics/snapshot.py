@@ -0,0 +1,237 @@
+# Local Parquet snapshots of the daily rates and the feature mart
+#
+# A table is stored as a dataset partitioned by bank and month
+#     data/parquet/<name>/bank_name=<slug>/month=<YYYY-MM>/part-0.parquet
+# next to _meta.json with the fingerprint of every partition in the database
+# (max date_page, row count and the newest row version). Every read compares the
+# fingerprints with the database and re-reads only the partitions that
+# changed, so training and charts iterate on local files. Without pyarrow or
+# with snapshot.enabled = false the tables are read from the database directly.
+# A refresh holds an exclusive lock on the snapshot directory (the pipeline and
+# serve.py refresh the same mart), reads take it shared.
+
+import fcntl
+import json
+import logging
+import operator
+import os
+import shutil
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+from omegaconf import OmegaConf
+
+from db import get_engine, iter_query, read_query
+from paths import ROOT_DIR
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# snapshot name -> (table, sort key)
+TABLES = {
+    'daily': ('myfin_dm.myfin_by_daily', ['bank_name', 'date_page']),
+    'mart': ('myfin_dm.myfin_by_for_model', ['bank_name', 'currency', 'side', 'date_page']),
+}
+
+PARTITION_COLUMNS = ('bank_name', 'month')
+
+FINGERPRINT_QUERY = """
+    select  t.bank_name
+            , to_char(t.date_page, 'YYYY-MM') as month
+            , max(t.date_page)::text as max_date_page
+            , count(*) as rows
+            -- xmin is the transaction that wrote the row version, an insert or an
+            -- update of any row of the partition (a rewritten series, a filled y,
+            -- a changed row of the refreshed view) raises the maximum
+            , max(t.xmin::text::bigint) as version
+    from    {table} t
+    group by 1, 2
+    """
+
+FRAME_OPERATORS = {'=': operator.eq, '==': operator.eq, '!=': operator.ne,
+                   '<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge}
+
+SQL_OPERATORS = {'=': '=', '==': '=', '!=': '<>', '<': '<', '<=': '<=', '>': '>', '>=': '>=',
+                 'in': '= any', 'not in': '<> all'}
+
+conf = OmegaConf.load(ROOT_DIR / 'conf/analytics/snapshot.yaml').snapshot
+
+
+def snapshot_dir(name):
+    return ROOT_DIR / conf.dir / name
+
+
+def disjunction(filters):
+    # like pyarrow: a list of (column, op, value) is a conjunction, a list of such lists is their OR
+    if not filters:
+        return []
+    return filters if isinstance(filters[0], list) else [filters]
+
+
+def filters_to_sql(filters):
+    groups, params = [], {}
+    for g, conjunction in enumerate(disjunction(filters)):
+        clauses = []
+        for i, (column, op, value) in enumerate(conjunction):
+            if op not in SQL_OPERATORS:
+                raise ValueError(f'Unsupported filter operator: {op}')
+            clauses.append(f'{column} {SQL_OPERATORS[op]}(%(p{g}_{i})s)')
+            params[f'p{g}_{i}'] = list(value) if op in ('in', 'not in') else value
+        groups.append('(' + ' and '.join(clauses) + ')')
+    return (' where ' + ' or '.join(groups)) if groups else '', params
+
+
+def filter_frame(df, filters):
+    # the same filters applied to an already read frame
+    mask = pd.Series(not filters, index=df.index)
+    for conjunction in disjunction(filters):
+        group = pd.Series(True, index=df.index)
+        for column, op, value in conjunction:
+            if op == 'in':
+                group &= df[column].isin(value)
+            elif op == 'not in':
+                group &= ~df[column].isin(value)
+            else:
+                group &= FRAME_OPERATORS[op](df[column], value)
+        mask |= group
+    return df.loc[mask].reset_index(drop=True)
+
+
+def read_from_db(name, filters=None):
+    table, key = TABLES[name]
+    where, params = filters_to_sql(filters)
+    return read_query(f"select * from {table}{where} order by {', '.join(key)}", params)
+
+
+def fingerprints(name):
+    table, _ = TABLES[name]
+    with get_engine().connect() as conn:
+        result = conn.exec_driver_sql(FINGERPRINT_QUERY.format(table=table)).all()
+    return {f'{bank_name}/{month}': [max_date_page, rows, version] for bank_name, month, max_date_page, rows, version in result}
+
+
+def load_meta(name):
+    path = snapshot_dir(name) / '_meta.json'
+    return json.loads(path.read_text()) if path.exists() else {}
+
+
+@contextmanager
+def locked(name, shared=False):
+    path = snapshot_dir(name)
+    path.mkdir(parents=True, exist_ok=True)
+    # the dot keeps the lock file out of the parquet dataset
+    with open(path / '.lock', 'w') as f:
+        fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def write_atomic(path, write):
+    # per process, like zion17/snapshots.py; the leading dot hides it from the dataset
+    tmp = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+    write(tmp)
+    os.replace(tmp, path)
+
+
+def write_partition(name, partition, df):
+    bank_name, month = partition.split('/')
+    path = snapshot_dir(name) / f'bank_name={bank_name}' / f'month={month}'
+    path.mkdir(parents=True, exist_ok=True)
+    table = pa.Table.from_pandas(df.drop(columns=['bank_name', 'month']), preserve_index=False)
+    write_atomic(path / 'part-0.parquet', lambda tmp: pq.write_table(table, tmp))
+
+
+def drop_partition(name, partition):
+    bank_name, month = partition.split('/')
+    shutil.rmtree(snapshot_dir(name) / f'bank_name={bank_name}' / f'month={month}', ignore_errors=True)
+
+
+def refresh(name):
+    """
+    Обновление снапшота name по отпечаткам партиций в базе
+        Из базы читаются только новые и изменившиеся партиции (bank_name, month),
+        партиции, которых в базе больше нет, удаляются. Под эксклюзивной
+        блокировкой: второй процесс дождется первого и найдет снапшот свежим
+    Args:
+        name (string): Имя снапшота из TABLES
+    Returns:
+        dict: Отпечатки партиций, с которыми совпадает снапшот
+    """
+    with locked(name):
+        table, _ = TABLES[name]
+        started = time.perf_counter()
+        current = fingerprints(name)
+        stored = load_meta(name).get('partitions', {})
+
+        stale = sorted(partition for partition, fingerprint in current.items() if stored.get(partition) != fingerprint)
+        removed = sorted(set(stored) - set(current))
+
+        if stale:
+            banks = sorted({partition.split('/')[0] for partition in stale})
+            date_from = min(partition.split('/')[1] for partition in stale) + '-01'
+            chunks = iter_query(
+                f"select * from {table} where bank_name = any(%(banks)s) and date_page >= %(date_from)s order by bank_name, date_page",
+                {'banks': banks, 'date_from': date_from}
+                )
+            # the rows come ordered by partition, a partition is written as soon as the next one starts,
+            # so only one partition and one chunk are in memory
+            pending = {}
+            for chunk in chunks:
+                chunk['month'] = chunk['date_page'].dt.strftime('%Y-%m')
+                for (bank_name, month), df_partition in chunk.groupby(['bank_name', 'month'], sort=False):
+                    partition = f'{bank_name}/{month}'
+                    for done in [p for p in pending if p != partition]:
+                        write_partition(name, done, pd.concat(pending.pop(done)))
+                    if partition in stale:
+                        pending.setdefault(partition, []).append(df_partition)
+            for partition, frames in pending.items():
+                write_partition(name, partition, pd.concat(frames))
+        for partition in removed:
+            drop_partition(name, partition)
+
+        write_atomic(
+            snapshot_dir(name) / '_meta.json',
+            lambda tmp: tmp.write_text(json.dumps({'table': table, 'partitions': current}, indent=1))
+            )
+        logging.info(
+            f' :::       Snapshot {name}: {len(current)} partitions, {len(stale)} re-read, '
+            f'{len(removed)} dropped in {time.perf_counter() - started:.2f}s'
+            )
+    return current
+
+
+def read_table(name, filters=None):
+    """
+    Таблица из локального снапшота, актуального на момент чтения
+        Фильтры в формате pyarrow: [(столбец, оператор, значение), ...],
+        по bank_name отбрасываются целые партиции
+    Args:
+        name (string): Имя снапшота из TABLES: daily или mart
+        filters (list): Фильтры строк
+    Returns:
+        pandas dataframe: Строки, отсортированные по ключу таблицы
+    """
+    if pa is None or not conf.enabled:
+        return read_from_db(name, filters)
+
+    if not refresh(name):
+        # empty table: nothing to take the columns from
+        return read_from_db(name, filters)
+
+    _, key = TABLES[name]
+    partitioning = ds.partitioning(pa.schema([(column, pa.string()) for column in PARTITION_COLUMNS]), flavor='hive')
+    # a refresh of another process does not replace or drop files under the read
+    with locked(name, shared=True):
+        dataset = ds.dataset(snapshot_dir(name), format='parquet', partitioning=partitioning)
+        table = dataset.to_table(filter=pq.filters_to_expression(filters) if filters else None)
+    # the parquet schema keeps the column types of the database result
+    df = table.to_pandas().drop(columns='month')
+    df = df[['date_page', 'bank_name'] + [c for c in df.columns if c not in ('date_page', 'bank_name')]]
+    return df.sort_values(key, ignore_index=True)
@@ -0,0 +1,13 @@
+-- the earliest page date fetched after a series watermark was written but lying
+-- behind it: a gap the crawler has filled later, the series is recomputed from there
+select  w.bank_name
+        , w.currency
+        , w.side
+        , min(cs.date_page) as date_page
+from    myfin_dm.myfin_by_for_model_watermark w
+join    myfin_raw.crawl_state cs
+on      cs.source = case when w.bank_name = 'nbrb' then 'nbrb' else 'banks' end
+and     cs.status = 'done'
+and     cs.date_page <= w.date_page
+and     cs.fetched_at > w.updated_at
+group by 1, 2, 3;
@@ -0,0 +1,29 @@
+-- bank name as published on myfin.by -> transliterated slug used in the marts,
+-- filled by 01_preparing_data_for_model.py once per new bank name
+CREATE TABLE IF NOT EXISTS myfin_dm.bank_slug (
+	bank_name varchar(50) NOT NULL,
+	bank_slug varchar(100) NOT NULL,
+	CONSTRAINT bank_slug_pkey PRIMARY KEY (bank_name)
+);
+
+-- normalized daily rates: one typed row per (bank slug, date) with the spreads,
+-- refreshed concurrently by 01_preparing_data_for_model.py before the mart build
+CREATE MATERIALIZED VIEW IF NOT EXISTS myfin_dm.myfin_by_daily AS
+SELECT  DISTINCT ON (bs.bank_slug, mr.date_page)
+        mr.date_page
+        , bs.bank_slug AS bank_name
+        , mr.price_value_usd_sell::float8 AS price_value_usd_sell
+        , mr.price_value_usd_buy::float8 AS price_value_usd_buy
+        , mr.price_value_eur_sell::float8 AS price_value_eur_sell
+        , mr.price_value_eur_buy::float8 AS price_value_eur_buy
+        , mr.price_value_rub_sell::float8 AS price_value_rub_sell
+        , mr.price_value_rub_buy::float8 AS price_value_rub_buy
+        , (mr.price_value_usd_buy - mr.price_value_usd_sell)::float8 AS bank_spred_usd
+        , (mr.price_value_eur_buy - mr.price_value_eur_sell)::float8 AS bank_spred_eur
+        , (mr.price_value_rub_buy - mr.price_value_rub_sell)::float8 AS bank_spred_rub
+FROM    myfin_raw.myfin_by mr
+JOIN    myfin_dm.bank_slug bs ON bs.bank_name = mr.bank_name
+ORDER BY bs.bank_slug, mr.date_page, mr.myfin_bank_id;
+-- REFRESH ... CONCURRENTLY needs a unique index
+CREATE UNIQUE INDEX IF NOT EXISTS myfin_by_daily_bank_name_date_page_idx ON myfin_dm.myfin_by_daily USING btree (bank_name, date_page);
+CREATE INDEX IF NOT EXISTS myfin_by_daily_date_page_idx ON myfin_dm.myfin_by_daily USING btree (date_page);
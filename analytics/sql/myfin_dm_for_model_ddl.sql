@@ -0,0 +1,92 @@
+-- feature mart, one row per (bank_name, currency, side, date_page)
+-- columns follow analytics/features.py::series_features, the window periods
+-- are conf/analytics/features.yaml::features.periods
+CREATE TABLE IF NOT EXISTS myfin_dm.myfin_by_for_model (
+	date_page date NOT NULL,
+	bank_name varchar(50) NOT NULL,
+	currency varchar(3) NOT NULL,
+	side varchar(4) NOT NULL,
+	price_value float8 NULL,
+	bank_spred float8 NULL,
+	cnt_up int4 NULL,
+	cnt_down int4 NULL,
+	diff_day float8 NULL,
+	diff_mean_5 float8 NULL,
+	mean_decay_5 float8 NULL,
+	diff_fl_5 float8 NULL,
+	mean_5 float8 NULL,
+	median_5 float8 NULL,
+	min_5 float8 NULL,
+	max_5 float8 NULL,
+	std_5 float8 NULL,
+	diff_mean_7 float8 NULL,
+	mean_decay_7 float8 NULL,
+	diff_fl_7 float8 NULL,
+	mean_7 float8 NULL,
+	median_7 float8 NULL,
+	min_7 float8 NULL,
+	max_7 float8 NULL,
+	std_7 float8 NULL,
+	diff_mean_14 float8 NULL,
+	mean_decay_14 float8 NULL,
+	diff_fl_14 float8 NULL,
+	mean_14 float8 NULL,
+	median_14 float8 NULL,
+	min_14 float8 NULL,
+	max_14 float8 NULL,
+	std_14 float8 NULL,
+	diff_mean_21 float8 NULL,
+	mean_decay_21 float8 NULL,
+	diff_fl_21 float8 NULL,
+	mean_21 float8 NULL,
+	median_21 float8 NULL,
+	min_21 float8 NULL,
+	max_21 float8 NULL,
+	std_21 float8 NULL,
+	diff_mean_28 float8 NULL,
+	mean_decay_28 float8 NULL,
+	diff_fl_28 float8 NULL,
+	mean_28 float8 NULL,
+	median_28 float8 NULL,
+	min_28 float8 NULL,
+	max_28 float8 NULL,
+	std_28 float8 NULL,
+	diff_mean_35 float8 NULL,
+	mean_decay_35 float8 NULL,
+	diff_fl_35 float8 NULL,
+	mean_35 float8 NULL,
+	median_35 float8 NULL,
+	min_35 float8 NULL,
+	max_35 float8 NULL,
+	std_35 float8 NULL,
+	diff_mean_60 float8 NULL,
+	mean_decay_60 float8 NULL,
+	diff_fl_60 float8 NULL,
+	mean_60 float8 NULL,
+	median_60 float8 NULL,
+	min_60 float8 NULL,
+	max_60 float8 NULL,
+	std_60 float8 NULL,
+	diff_mean_100 float8 NULL,
+	mean_decay_100 float8 NULL,
+	diff_fl_100 float8 NULL,
+	mean_100 float8 NULL,
+	median_100 float8 NULL,
+	min_100 float8 NULL,
+	max_100 float8 NULL,
+	std_100 float8 NULL,
+	y float8 NULL,
+	y_predict float8 NULL,
+	CONSTRAINT myfin_by_for_model_pkey PRIMARY KEY (bank_name, currency, side, date_page)
+);
+CREATE INDEX IF NOT EXISTS myfin_by_for_model_bank_name_date_page_idx ON myfin_dm.myfin_by_for_model USING btree (bank_name, date_page);
+
+-- the last date of every series written to the mart
+CREATE TABLE IF NOT EXISTS myfin_dm.myfin_by_for_model_watermark (
+	bank_name varchar(50) NOT NULL,
+	currency varchar(3) NOT NULL,
+	side varchar(4) NOT NULL,
+	date_page date NOT NULL,
+	updated_at timestamp NOT NULL DEFAULT now(),
+	CONSTRAINT myfin_by_for_model_watermark_pkey PRIMARY KEY (bank_name, currency, side)
+);
\ No newline at end of file
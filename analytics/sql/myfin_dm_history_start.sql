@@ -0,0 +1,16 @@
+-- the first date_page an incremental mart refresh reads for every bank: the
+-- %(rows)s-th daily row back from its restart date, counted in rows because the
+-- windows of the features are rows, not days
+select  h.bank_name
+        , min(h.date_page) as date_page
+from    (
+        select  d.bank_name
+                , d.date_page
+                , row_number() over (partition by d.bank_name order by d.date_page desc) as rn
+        from    myfin_dm.myfin_by_daily d
+        join    unnest(%(banks)s::text[], %(restarts)s::date[]) as r(bank_name, restart)
+        on      r.bank_name = d.bank_name
+        and     d.date_page <= r.restart
+        ) h
+where   h.rn <= %(rows)s
+group by 1;
@@ -0,0 +1,15 @@
+-- forecasts of analytics/03_predict.py: one row per (series, last known day, horizon),
+-- target_date = date_page + horizon days
+CREATE TABLE IF NOT EXISTS myfin_dm.myfin_by_predict (
+	bank_name varchar(50) NOT NULL,
+	currency varchar(3) NOT NULL,
+	side varchar(4) NOT NULL,
+	date_page date NOT NULL,
+	horizon int4 NOT NULL,
+	target_date date NOT NULL,
+	y_predict float8 NULL,
+	model varchar(100) NOT NULL,
+	latency_ms float8 NULL,
+	predicted_at timestamp NOT NULL DEFAULT now(),
+	CONSTRAINT myfin_by_predict_pkey PRIMARY KEY (bank_name, currency, side, date_page, horizon)
+);
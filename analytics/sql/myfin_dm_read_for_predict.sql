@@ -1,4 +0,0 @@
-select  *
-from 	myfin_dm.myfin_by_for_model mr 
-where   bank_name = 'nbrb'
-and     y is null;
\ No newline at end of file
@@ -0,0 +1,19 @@
+select  date_page
+        , bank_name
+        , currency
+        , side
+        , horizon
+        , target_date
+        , y_predict
+from    myfin_dm.myfin_by_predict
+where   bank_name = %(bank_name)s
+and     currency = %(currency)s
+and     side = %(side)s
+and     date_page = (
+            select  max(date_page)
+            from    myfin_dm.myfin_by_predict
+            where   bank_name = %(bank_name)s
+            and     currency = %(currency)s
+            and     side = %(side)s
+        )
+order by horizon;
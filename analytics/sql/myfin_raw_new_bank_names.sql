@@ -0,0 +1,8 @@
+select  distinct mr.bank_name
+from 	myfin_raw.myfin_by mr
+where   mr.bank_name is not null
+and     not exists (
+            select  1
+            from    myfin_dm.bank_slug bs
+            where   bs.bank_name = mr.bank_name
+        );
\ No newline at end of file
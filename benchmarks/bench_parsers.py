@@ -0,0 +1,109 @@
+# Micro-benchmark of the myfin.by page parsers over saved HTML pages
+#
+#     python -m benchmarks.bench_parsers                     (benchmarks/fixtures/*.html)
+#     python -m benchmarks.bench_parsers snapshots --source myfin --limit 50
+#
+# The current zion17/spiders/parsers.py is compared with the per-field
+# response.xpath parser it replaced (kept below as the reference). Both must
+# return the same items, the rows per second include building the response.
+
+import argparse
+import glob
+import os
+import time
+
+from scrapy.http import HtmlResponse
+
+from zion17.items import MyfinItem
+from zion17.snapshots import SnapshotStore
+from zion17.spiders import parsers
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), 'fixtures')
+NBRB_BLOCK = './/*[@class="course-brief-info course-brief-info--nbrb course-brief-info--desk"]/div[2]'
+PRICE_CELL = './td[@class="currencies-courses__currency-cell"]/span/text()'
+
+
+def reference_date_page(response):
+    date_page = response.xpath('.//*[@class="top-content__inline-title"]/h1/text()')
+    day, month, year = date_page[1].extract().split()[1].split('.')
+    return f'{year}-{month}-{day}'
+
+
+def reference_banks(response):
+    for row in response.xpath('.//*[@class="sort_body"]/tr'):
+        myfin_item = MyfinItem()
+        myfin_item['date_page'] = reference_date_page(response)
+        myfin_item['myfin_bank_id'] = row.xpath('./@id')[0].extract().split('-')[2]
+        myfin_item['bank_name'] = row.xpath('./td/span/span/img/@alt')[0].extract()
+        for index, field in enumerate(parsers.PRICE_FIELDS):
+            myfin_item[field] = row.xpath(PRICE_CELL)[index].extract()
+        yield myfin_item
+
+
+def reference_nbrb(response):
+    myfin_item = MyfinItem()
+    myfin_item['date_page'] = reference_date_page(response)
+    myfin_item['myfin_bank_id'] = parsers.NBRB_BANK_ID
+    myfin_item['bank_name'] = 'НБРБ'
+    for currency, position in (('usd', 2), ('eur', 4), ('rub', 6)):
+        price = response.xpath(f'{NBRB_BLOCK}/div[{position}]/div[1]/span/text()')[0].extract()
+        myfin_item[f'price_value_{currency}_sell'] = price
+        myfin_item[f'price_value_{currency}_buy'] = price
+    yield myfin_item
+
+
+def reference_parse(response):
+    return [*reference_banks(response), *reference_nbrb(response)]
+
+
+def current_parse(response):
+    date_page = parsers.parse_date_page(response.selector.root)
+    return [*parsers.parse_banks(response, date_page), *parsers.parse_nbrb(response, date_page)]
+
+
+def load_pages(paths, source=None, limit=None):
+    pages = []
+    for path in paths:
+        if os.path.isdir(path) and source:
+            store = SnapshotStore(path)
+            for date_page in list(store.dates(source))[:limit]:
+                pages.append(store.load(source, date_page))
+        else:
+            with open(path, 'rb') as f:
+                pages.append((f'file://{os.path.abspath(path)}', f.read()))
+    return pages[:limit]
+
+
+def bench(parse, pages, repeat):
+    best, rows = None, 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        rows = sum(len(parse(HtmlResponse(url=url, body=body, encoding='utf-8'))) for url, body in pages)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return rows, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the myfin.by page parsers')
+    parser.add_argument('paths', nargs='*', default=sorted(glob.glob(os.path.join(FIXTURES_DIR, '*.html'))),
+                        help='html files, or a snapshot archive directory with --source')
+    parser.add_argument('--source', help='snapshot source to read from an archive directory')
+    parser.add_argument('--limit', type=int, default=None, help='pages to take')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per parser, the best one is reported')
+    args = parser.parse_args()
+
+    pages = load_pages(args.paths, args.source, args.limit)
+    for url, body in pages:
+        response = HtmlResponse(url=url, body=body, encoding='utf-8')
+        expected = [dict(item) for item in reference_parse(response)]
+        assert [dict(item) for item in current_parse(response)] == expected, f'{url}: items differ'
+
+    print(f'{len(pages)} pages, items identical')
+    for name, parse in (('reference', reference_parse), ('current', current_parse)):
+        rows, elapsed = bench(parse, pages, args.repeat)
+        print(f'{name:<10} {rows} rows in {elapsed * 1000:.1f} ms, {rows / elapsed:,.0f} rows/s')
+
+
+if __name__ == '__main__':
+    main()
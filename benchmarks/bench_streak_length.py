@@ -0,0 +1,54 @@
+# Benchmark of features.streak_length against the iterrows counter it replaced
+#
+#     python -m benchmarks.bench_streak_length --years 10 --banks 50
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'analytics'))
+
+from features import streak_length
+
+
+def count_up_loop(df):
+    cnt_up = 0
+    result = []
+    for idx, row in df.iterrows():
+        if row['is_up'] == 1:
+            cnt_up += 1
+        elif row['is_up'] in [0, -1] and cnt_up > 0:
+            cnt_up = 0
+        result.append(cnt_up)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the up/down streak counter')
+    parser.add_argument('--years', type=int, default=10)
+    parser.add_argument('--banks', type=int, default=50)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(17)
+    df = pd.DataFrame({'is_up': rng.choice([-1, 0, 1], size=args.years * 365 * args.banks)})
+
+    started = time.perf_counter()
+    expected = count_up_loop(df)
+    loop_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    result = streak_length(df['is_up'] == 1)
+    vector_seconds = time.perf_counter() - started
+
+    assert result.tolist() == expected, 'streak_length differs from the loop'
+    print(f'{len(df)} rows, output identical')
+    print(f'iterrows loop  {loop_seconds * 1000:10.1f} ms')
+    print(f'streak_length  {vector_seconds * 1000:10.1f} ms  ({loop_seconds / vector_seconds:,.0f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,4 @@
--- database PostgreSQL
+-- database PostgreSQL, applied with psql -f database_ddl/ddl.sql (\ir needs psql)
 
 Create database myfin;
 
@@ -6,15 +6,16 @@ CREATE SCHEMA myfin_raw;
 CREATE SCHEMA myfin_dm;
 
 CREATE TABLE myfin_raw.myfin_by (
-	myfin_bank_id int4 NULL,
+	myfin_bank_id int4 NOT NULL,
 	price_value_usd_sell numeric NULL,
 	price_value_usd_buy numeric NULL,
 	price_value_eur_sell numeric NULL,
 	price_value_eur_buy numeric NULL,
 	price_value_rub_sell numeric NULL,
 	price_value_rub_buy numeric NULL,
-	date_page date NULL,
+	date_page date NOT NULL,
 	bank_name varchar(50) NULL,
+	CONSTRAINT myfin_by_date_page_bank_id_key UNIQUE (date_page, myfin_bank_id)
 );
 CREATE INDEX myfin_raw_bank_name_idx ON myfin_raw.myfin_by USING btree (bank_name);
 CREATE INDEX myfin_raw_date_page_idx ON myfin_raw.myfin_by USING btree (date_page);
@@ -28,3 +29,21 @@ CREATE TABLE myfin_raw.cbr_ru (
 );
 CREATE INDEX cbr_ru_bank_name_idx ON myfin_raw.cbr_ru USING btree (bank_name);
 CREATE INDEX cbr_ru_date_page_idx ON myfin_raw.cbr_ru USING btree (date_page);
+
+-- one row per fetched page and source ('banks', 'nbrb'), maintained by zion17.pipelines.MyfinPipeline
+CREATE TABLE myfin_raw.crawl_state (
+	source varchar(20) NOT NULL,
+	date_page date NOT NULL,
+	status varchar(20) NOT NULL,
+	rows int4 NOT NULL,
+	fetched_at timestamp NOT NULL DEFAULT now(),
+	CONSTRAINT crawl_state_pkey PRIMARY KEY (source, date_page)
+);
+CREATE INDEX crawl_state_done_idx ON myfin_raw.crawl_state USING btree (source, date_page) WHERE status = 'done';
+
+-- the myfin_dm tables are created by the analytics scripts from analytics/sql
+-- (CREATE ... IF NOT EXISTS on every run); psql includes the same files here,
+-- so there is one definition of every column
+\ir ../analytics/sql/myfin_dm_daily_ddl.sql
+\ir ../analytics/sql/myfin_dm_for_model_ddl.sql
+\ir ../analytics/sql/myfin_dm_predict_ddl.sql
@@ -0,0 +1,27 @@
+-- One-off migration: remove duplicated rows from myfin_raw.myfin_by
+-- and add the (date_page, myfin_bank_id) natural key used by the pipeline upsert
+
+BEGIN;
+
+DELETE FROM myfin_raw.myfin_by
+WHERE date_page IS NULL
+   OR myfin_bank_id IS NULL;
+
+-- keep the most recently written row of every (date_page, myfin_bank_id)
+DELETE FROM myfin_raw.myfin_by t
+USING (
+    SELECT  ctid
+            , row_number() OVER (PARTITION BY date_page, myfin_bank_id ORDER BY xmin::text::bigint DESC) AS rn
+    FROM    myfin_raw.myfin_by
+) dup
+WHERE t.ctid = dup.ctid
+  AND dup.rn > 1;
+
+ALTER TABLE myfin_raw.myfin_by
+    ALTER COLUMN date_page SET NOT NULL,
+    ALTER COLUMN myfin_bank_id SET NOT NULL,
+    ADD CONSTRAINT myfin_by_date_page_bank_id_key UNIQUE (date_page, myfin_bank_id);
+
+COMMIT;
+
+VACUUM ANALYZE myfin_raw.myfin_by;
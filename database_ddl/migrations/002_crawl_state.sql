@@ -0,0 +1,28 @@
+-- One-off migration: create myfin_raw.crawl_state and fill it from the dates
+-- already loaded into myfin_raw.myfin_by
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS myfin_raw.crawl_state (
+	source varchar(20) NOT NULL,
+	date_page date NOT NULL,
+	status varchar(20) NOT NULL,
+	rows int4 NOT NULL,
+	fetched_at timestamp NOT NULL DEFAULT now(),
+	CONSTRAINT crawl_state_pkey PRIMARY KEY (source, date_page)
+);
+CREATE INDEX IF NOT EXISTS crawl_state_done_idx ON myfin_raw.crawl_state USING btree (source, date_page) WHERE status = 'done';
+
+INSERT INTO myfin_raw.crawl_state (source, date_page, status, rows, fetched_at)
+SELECT  CASE WHEN myfin_bank_id = 999999 THEN 'nbrb' ELSE 'banks' END AS source
+        , date_page
+        , 'done'
+        , count(*)
+        , now()
+FROM    myfin_raw.myfin_by
+GROUP BY 1, 2
+ON CONFLICT (source, date_page) DO NOTHING;
+
+COMMIT;
+
+ANALYZE myfin_raw.crawl_state;
@@ -0,0 +1,7 @@
+-- One-off migration: the feature mart used to be created by pandas.to_sql with
+-- inferred column types. Drop it, 01_preparing_data_for_model.py recreates it
+-- from analytics/sql/myfin_dm_for_model_ddl.sql and runs a full rebuild
+-- because the watermark table is empty.
+
+DROP TABLE IF EXISTS myfin_dm.myfin_by_for_model;
+DROP TABLE IF EXISTS myfin_dm.myfin_by_for_model_watermark;
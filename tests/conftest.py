@@ -0,0 +1,5 @@
+# The analytics scripts import their modules by name from analytics/
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'analytics'))
@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from features import history_rows, series_features, streak_length
+
+
+def count_up_loop(df):
+    # the iterrows counter streak_length replaced in 01_preparing_data_for_model.py
+    cnt_up = 0
+    result = []
+    for idx, row in df.iterrows():
+        if row['is_up'] == 1:
+            cnt_up += 1
+        elif row['is_up'] in [0, -1] and cnt_up > 0:
+            cnt_up = 0
+        result.append(cnt_up)
+    return result
+
+
+def count_down_loop(df):
+    cnt_down = 0
+    result = []
+    for idx, row in df.iterrows():
+        if row['is_up'] == -1:
+            cnt_down += 1
+        elif row['is_up'] in [0, 1] and cnt_down > 0:
+            cnt_down = 0
+        result.append(cnt_down)
+    return result
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('values', [[0, 1], [-1, 0, 1]])
+def test_streak_length_matches_loop(seed, values):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({'is_up': rng.choice(values, size=500)})
+
+    assert streak_length(df['is_up'] == 1).tolist() == count_up_loop(df)
+    assert streak_length(df['is_up'] == -1).tolist() == count_down_loop(df)
+
+
+@pytest.mark.parametrize('mask, expected', [
+    ([], []),
+    ([False, True, True, False, True], [0, 1, 2, 0, 1]),
+    ([True, True, True], [1, 2, 3]),
+    ([False, False], [0, 0]),
+])
+def test_streak_length_edges(mask, expected):
+    assert streak_length(mask).tolist() == expected
+
+
+@pytest.mark.parametrize('restart', ['2023-09-30', '2023-11-15', '2024-01-31'])
+def test_incremental_rows_match_full_rebuild(restart):
+    # a series with missing days and missing prices: history_rows counts rows, a fixed
+    # number of days before the restart would leave the largest window short
+    periods = [5, 7, 14, 21, 28, 35, 60, 100]
+    rng = np.random.default_rng(7)
+    dates = pd.date_range('2023-01-01', '2024-03-31', freq='D')
+    dates = dates[rng.random(len(dates)) > 0.4]
+    price = 3 + rng.normal(0, 0.01, len(dates)).cumsum()
+    # a missing price drops the rows whose windows cover it, in both modes
+    price[10] = np.nan
+    df_series = pd.DataFrame({
+        'date_page': dates, 'bank_name': 'bank', 'currency': 'usd', 'side': 'sell',
+        'price_value': price, 'bank_spred': rng.normal(0.05, 0.01, len(dates)),
+    })
+    restart = pd.Timestamp(restart)
+
+    df_full = series_features(df_series.copy(), periods)
+    start = df_series.loc[df_series['date_page'] <= restart, 'date_page'].iloc[-history_rows(periods)]
+    df_incremental = series_features(df_series.loc[df_series['date_page'] >= start].reset_index(drop=True), periods)
+
+    # the rows written after the restart and the y of the last row before it
+    last_before = df_full.loc[df_full['date_page'] <= restart, 'date_page'].max()
+    expected = df_full.loc[df_full['date_page'] >= last_before].reset_index(drop=True)
+    assert len(expected) > 1
+    actual = df_incremental.loc[df_incremental['date_page'] >= last_before].reset_index(drop=True)
+    pd.testing.assert_frame_equal(actual, expected)
@@ -0,0 +1,22 @@
+import numpy as np
+import pandas as pd
+
+from forecast import horizon_targets
+
+
+def test_horizon_targets_follow_dates_not_rows():
+    # 2024-01-03 is missing: the row before it has no 1-day target
+    df = pd.DataFrame({
+        'bank_name': ['a'] * 4 + ['b'] * 2,
+        'currency': 'usd',
+        'side': 'sell',
+        'date_page': pd.to_datetime(['2024-01-01', '2024-01-02', '2024-01-04', '2024-01-05', '2024-01-01', '2024-01-02']),
+        'price_value': [1.0, 2.0, 4.0, 5.0, 10.0, 20.0],
+    }, index=[10, 11, 12, 13, 14, 15])
+
+    targets = horizon_targets(df, [1, 2, 3])
+
+    assert list(targets.index) == list(df.index)
+    np.testing.assert_array_equal(targets['y_1'], [2.0, np.nan, 5.0, np.nan, 20.0, np.nan])
+    np.testing.assert_array_equal(targets['y_2'], [np.nan, 4.0, np.nan, np.nan, np.nan, np.nan])
+    np.testing.assert_array_equal(targets['y_3'], [4.0, 5.0, np.nan, np.nan, np.nan, np.nan])
@@ -0,0 +1,72 @@
+# Define here your scrapy extensions
+#
+# See documentation in:
+# https://docs.scrapy.org/en/latest/topics/extensions.html
+
+import time
+
+from scrapy import signals
+
+from zion17.metrics import Stage
+
+
+def percentile(values, q):
+    # nearest-rank percentile of an already sorted list
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, max(0, round(q / 100 * len(values)) - 1))
+    return values[index]
+
+
+class MyfinCrawlStats:
+    # Logs the crawl throughput and download latency percentiles when the
+    # spider closes and keeps them in the crawler stats under myfin/* and
+    # in logs/metrics.jsonl as the crawl.<spider> stage.
+
+    def __init__(self, stats):
+        self.stats = stats
+        self.latencies = []
+        self.started = None
+        self.stage = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        s = cls(crawler.stats)
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.response_received, signal=signals.response_received)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    def spider_opened(self, spider):
+        self.started = time.monotonic()
+        self.stage = Stage(f'crawl.{spider.name}', profile=spider.settings.get('CRAWL_PROFILE')).start()
+
+    def response_received(self, response, request, spider):
+        # cached and archived responses have no download latency
+        if 'download_latency' in request.meta:
+            self.latencies.append(request.meta['download_latency'])
+
+    def spider_closed(self, spider):
+        elapsed = time.monotonic() - self.started
+        latencies = sorted(self.latencies)
+        crawl_stats = {
+            'pages': len(latencies),
+            'pages_per_sec': round(len(latencies) / elapsed, 3) if elapsed else 0.0,
+            'latency_p50': round(percentile(latencies, 50), 3),
+            'latency_p90': round(percentile(latencies, 90), 3),
+            'latency_p99': round(percentile(latencies, 99), 3),
+        }
+        for key, value in crawl_stats.items():
+            self.stats.set_value(f'myfin/{key}', value)
+
+        self.stage.rows_in = self.stats.get_value('response_received_count', 0)
+        self.stage.rows_out = self.stats.get_value('item_scraped_count', 0)
+        self.stage.tags.update(crawl_stats)
+        self.stage.stop()
+
+        spider.logger.info(
+            f"Crawl stats ({spider.settings.get('CRAWL_PROFILE')} profile): "
+            f"{crawl_stats['pages']} pages in {elapsed:.1f}s, {crawl_stats['pages_per_sec']} pages/s, "
+            f"latency p50 {crawl_stats['latency_p50']}s, p90 {crawl_stats['latency_p90']}s, "
+            f"p99 {crawl_stats['latency_p99']}s"
+        )
@@ -0,0 +1,66 @@
+# HTTP cache policy and storage for myfin.by pages
+#
+# See documentation in:
+# https://docs.scrapy.org/en/latest/topics/downloader-middleware.html#httpcache-middleware-settings
+
+import shutil
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+from scrapy.extensions.httpcache import FilesystemCacheStorage, RFC2616Policy
+
+
+class MyfinCachePolicy(RFC2616Policy):
+    # Rates of a past day do not change once published, so a cached page
+    # older than MYFIN_HTTPCACHE_IMMUTABLE_DAYS is served without any request.
+    # Recent pages keep the RFC 2616 behaviour: the stored ETag and
+    # Last-Modified are sent as If-None-Match / If-Modified-Since and a 304
+    # answer reuses the cached body.
+
+    def __init__(self, settings):
+        super().__init__(settings)
+        self.immutable_days = settings.getint('MYFIN_HTTPCACHE_IMMUTABLE_DAYS', 3)
+
+    def is_immutable(self, request):
+        # the spiders put the page date (dd-mm-YYYY) into request.meta['dt']
+        if 'dt' not in request.meta:
+            return False
+        page_date = datetime.strptime(request.meta['dt'], '%d-%m-%Y').date()
+        return page_date < date.today() - timedelta(days=self.immutable_days)
+
+    def should_cache_response(self, response, request):
+        # never keep an error page, it would be served as the final answer
+        return response.status == 200 and super().should_cache_response(response, request)
+
+    def is_cached_response_fresh(self, cachedresponse, request):
+        if self.is_immutable(request):
+            return True
+        return super().is_cached_response_fresh(cachedresponse, request)
+
+
+class MyfinCacheStorage(FilesystemCacheStorage):
+    # The cache holds the same pages as the snapshot archive (zion17/snapshots.py)
+    # and follows its retention rule: when the spider closes, entries stored more
+    # than MYFIN_SNAPSHOT_RETENTION_DAYS ago are removed (0 keeps them forever).
+
+    def __init__(self, settings):
+        super().__init__(settings)
+        self.retention_days = settings.getint('MYFIN_SNAPSHOT_RETENTION_DAYS')
+
+    def close_spider(self, spider):
+        super().close_spider(spider)
+        removed = self.prune(spider)
+        spider.logger.info(f"HTTP cache pruned: {removed} entries removed")
+
+    def prune(self, spider):
+        if not self.retention_days:
+            return 0
+        expired = time.time() - self.retention_days * 24 * 3600
+        removed = 0
+        # <cachedir>/<spider>/<fingerprint[:2]>/<fingerprint>/pickled_meta, rewritten on every store
+        for meta_path in Path(self.cachedir, spider.name).glob('*/*/pickled_meta'):
+            if meta_path.stat().st_mtime < expired:
+                shutil.rmtree(meta_path.parent, ignore_errors=True)
+                removed += 1
+        return removed
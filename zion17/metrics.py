@@ -0,0 +1,178 @@
+# Per-stage timing and resource metrics of the daily pipeline
+#
+#     with Stage('features') as stage:
+#         ...
+#         stage.rows_in = len(df)
+#
+#     @Stage('train')
+#     def main():
+#         ...
+#         count_rows(rows_in=len(df))
+#
+# Every finished stage appends one JSON line to logs/metrics.jsonl: wall and
+# CPU time (own and of the finished child processes), peak RSS of the process,
+# rows in/out and the number and duration of database queries run while the
+# stage was active. The trends over days:
+#
+#     python -m zion17.metrics report --days 14
+
+import argparse
+import json
+import resource
+import time
+from contextlib import ContextDecorator
+from datetime import datetime
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+METRICS_FILE = ROOT_DIR / 'logs' / 'metrics.jsonl'
+
+# stages running right now, innermost last
+active_stages = []
+
+
+def rusage():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    # ru_maxrss is in kilobytes on Linux
+    return {
+        'cpu': own.ru_utime + own.ru_stime,
+        'children_cpu': children.ru_utime + children.ru_stime,
+        'peak_rss_mb': round(max(own.ru_maxrss, children.ru_maxrss) / 1024, 1),
+    }
+
+
+def add_db_time(seconds, queries=1):
+    for stage in active_stages:
+        stage.db_seconds += seconds
+        stage.db_queries += queries
+
+
+def count_rows(rows_in=None, rows_out=None):
+    if not active_stages:
+        return
+    stage = active_stages[-1]
+    if rows_in is not None:
+        stage.rows_in = (stage.rows_in or 0) + rows_in
+    if rows_out is not None:
+        stage.rows_out = (stage.rows_out or 0) + rows_out
+
+
+class Stage(ContextDecorator):
+    """
+    One measured step of the pipeline, as a context manager, a decorator or
+    with explicit start() / stop() when the step spans callbacks (a spider).
+    """
+
+    def __init__(self, name, **tags):
+        self.name = name
+        self.tags = tags
+
+    def start(self):
+        self.rows_in = None
+        self.rows_out = None
+        self.db_seconds = 0.0
+        self.db_queries = 0
+        self.started_at = datetime.now()
+        self.wall_started = time.perf_counter()
+        self.usage_started = rusage()
+        active_stages.append(self)
+        return self
+
+    def stop(self, status='ok'):
+        usage = rusage()
+        if self in active_stages:
+            active_stages.remove(self)
+        record = {
+            'stage': self.name,
+            'started_at': self.started_at.isoformat(timespec='seconds'),
+            'status': status,
+            'wall_s': round(time.perf_counter() - self.wall_started, 3),
+            'cpu_s': round(usage['cpu'] - self.usage_started['cpu'], 3),
+            'children_cpu_s': round(usage['children_cpu'] - self.usage_started['children_cpu'], 3),
+            'peak_rss_mb': usage['peak_rss_mb'],
+            'rows_in': self.rows_in,
+            'rows_out': self.rows_out,
+            'db_queries': self.db_queries,
+            'db_s': round(self.db_seconds, 3),
+            **self.tags,
+        }
+        write_record(record)
+        return record
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop('ok' if exc_type is None else f'error: {exc_type.__name__}')
+        return False
+
+
+def write_record(record):
+    METRICS_FILE.parent.mkdir(exist_ok=True)
+    # one short line per write, appends from several processes do not interleave
+    with open(METRICS_FILE, 'a') as f:
+        f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+
+def load_records(days=None):
+    if not METRICS_FILE.exists():
+        return []
+    with open(METRICS_FILE) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    if days is not None:
+        since = datetime.now().date().toordinal() - days + 1
+        records = [r for r in records if datetime.fromisoformat(r['started_at']).date().toordinal() >= since]
+    return records
+
+
+def report(days=14, stage=None):
+    import pandas as pd
+
+    df = pd.DataFrame(load_records(days))
+    if df.empty:
+        print(f'No metrics in {METRICS_FILE}')
+        return df
+    if stage is not None:
+        df = df.loc[df['stage'] == stage]
+    df['date'] = df['started_at'].str[:10]
+    df['errors'] = (df['status'] != 'ok').astype(int)
+
+    daily = df.groupby(['stage', 'date']).agg(
+        runs=('stage', 'size'),
+        errors=('errors', 'sum'),
+        wall_s=('wall_s', 'sum'),
+        cpu_s=('cpu_s', 'sum'),
+        children_cpu_s=('children_cpu_s', 'sum'),
+        db_s=('db_s', 'sum'),
+        db_queries=('db_queries', 'sum'),
+        peak_rss_mb=('peak_rss_mb', 'max'),
+        rows_in=('rows_in', 'sum'),
+        rows_out=('rows_out', 'sum'),
+        ).round(2)
+    # the last day against the median of the days before it
+    trend = daily.groupby(level='stage')['wall_s'].agg(
+        lambda s: (s.iloc[-1] / s.iloc[:-1].median() - 1) * 100 if len(s) > 1 and s.iloc[:-1].median() else float('nan')
+        ).round(1).rename('wall_vs_median_%')
+
+    with pd.option_context('display.width', 200, 'display.max_rows', None, 'display.max_columns', None):
+        print(daily.to_string())
+        print()
+        print(trend.to_string())
+    return daily
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pipeline stage metrics from logs/metrics.jsonl')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    report_parser = subparsers.add_parser('report', help='per day totals of every stage')
+    report_parser.add_argument('--days', type=int, default=14)
+    report_parser.add_argument('--stage', help='only this stage')
+    args = parser.parse_args()
+
+    if args.command == 'report':
+        report(args.days, args.stage)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,11 +3,20 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
+import time
+
 from scrapy import signals
+from scrapy.downloadermiddlewares.retry import RetryMiddleware
+from scrapy.exceptions import NotConfigured
+from scrapy.utils.defer import maybe_deferred_to_future
+from twisted.internet.task import deferLater
 
 # useful for handling different item types with a single interface
 from itemadapter import is_item, ItemAdapter
 
+from zion17.snapshots import SnapshotStore
+from zion17.spiders.generate_date_list import change_date_format
+
 
 class MyfinSpiderMiddleware:
     # Not all methods need to be defined. If a method is not defined,
@@ -101,3 +110,118 @@ class MyfinDownloaderMiddleware:
 
     def spider_opened(self, spider):
         spider.logger.info("Spider opened: %s" % spider.name)
+
+
+class MyfinSnapshotMiddleware:
+    # Stores the body of every downloaded myfin.by page in the snapshot
+    # archive (see zion17/snapshots.py), so the pages can be re-parsed
+    # offline with `python -m zion17.replay`.
+
+    def __init__(self, store):
+        self.store = store
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('MYFIN_SNAPSHOT_ENABLED'):
+            raise NotConfigured
+        s = cls(SnapshotStore(
+            crawler.settings.get('MYFIN_SNAPSHOT_DIR'),
+            crawler.settings.getint('MYFIN_SNAPSHOT_RETENTION_DAYS'),
+        ))
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    def process_response(self, request, response, spider):
+        # only pages requested by the spiders for a date are archived,
+        # a page served from the http cache is already in the archive
+        if response.status == 200 and 'dt' in request.meta and 'cached' not in response.flags:
+            self.store.save(
+                request.meta.get('snapshot_source', 'myfin'),
+                change_date_format(request.meta['dt']),
+                response.url,
+                response.body,
+            )
+        return response
+
+    def spider_closed(self, spider):
+        removed = self.store.prune()
+        spider.logger.info(f"Snapshot archive pruned: {removed} objects removed")
+
+
+class MyfinRetryMiddleware(RetryMiddleware):
+    # RetryMiddleware that waits before retrying 429/5xx responses:
+    # min(MYFIN_RETRY_BACKOFF_BASE * 2 ** retries, MYFIN_RETRY_BACKOFF_MAX)
+    # seconds, or the Retry-After header of the response when it is given.
+    # The downloader frees the slot before process_response runs, so waiting
+    # here would hold back only the retried request. For 429 and 503 (the site
+    # asks to slow down) the whole download slot is paused instead: its delay
+    # is raised to the backoff, not randomized, and counted from now; the retry
+    # and every queued request of the domain wait for it. Other codes wait
+    # for the retried request only.
+    SLOT_PAUSE_CODES = (429, 503)
+
+    def __init__(self, settings, crawler=None):
+        super().__init__(settings)
+        self.crawler = crawler
+        self.backoff_base = settings.getfloat('MYFIN_RETRY_BACKOFF_BASE', 5)
+        self.backoff_max = settings.getfloat('MYFIN_RETRY_BACKOFF_MAX', 120)
+        # slot key -> (delay, randomize_delay) before the pause, and when the pause ends
+        self.slot_settings = {}
+        self.paused_until = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.settings, crawler)
+
+    def backoff_delay(self, request, response):
+        retry_after = response.headers.get('Retry-After')
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), self.backoff_max)
+        return min(self.backoff_base * 2 ** request.meta.get('retry_times', 0), self.backoff_max)
+
+    def pause_slot(self, request, delay):
+        from twisted.internet import reactor
+        key = request.meta.get('download_slot')
+        slot = self.crawler.engine.downloader.slots.get(key) if self.crawler and self.crawler.engine else None
+        if slot is None:
+            return False
+        self.slot_settings.setdefault(key, (slot.delay, slot.randomize_delay))
+        slot.delay = max(slot.delay, delay)
+        slot.randomize_delay = False
+        slot.lastseen = time.time()
+        self.paused_until[key] = max(self.paused_until.get(key, 0), slot.lastseen + delay)
+        reactor.callLater(delay, self.resume_slot, key)
+        return True
+
+    def resume_slot(self, key):
+        # a later 429 may have extended the pause, its own call resumes the slot
+        if time.time() < self.paused_until.get(key, 0) - 0.01:
+            return
+        self.paused_until.pop(key, None)
+        delay, randomize_delay = self.slot_settings.pop(key, (None, None))
+        slot = self.crawler.engine.downloader.slots.get(key)
+        if slot is not None and delay is not None:
+            slot.delay, slot.randomize_delay = delay, randomize_delay
+
+    async def process_response(self, request, response, spider):
+        key = request.meta.get('download_slot')
+        if key in self.paused_until:
+            # autothrottle may have lowered the delay of the paused slot on this response
+            slot = self.crawler.engine.downloader.slots.get(key)
+            if slot is not None:
+                slot.delay = max(slot.delay, self.paused_until[key] - slot.lastseen)
+        if (
+            not request.meta.get('dont_retry', False)
+            and response.status in self.retry_http_codes
+            and request.meta.get('retry_times', 0) < request.meta.get('max_retry_times', self.max_retry_times)
+        ):
+            delay = self.backoff_delay(request, response)
+            spider.crawler.stats.inc_value('myfin/retry_backoff_seconds', delay)
+            if response.status in self.SLOT_PAUSE_CODES and self.pause_slot(request, delay):
+                spider.logger.info(f"Got {response.status} for {request.url}, domain paused for {delay:.0f}s")
+                spider.crawler.stats.inc_value('myfin/slot_pauses')
+            else:
+                spider.logger.info(f"Got {response.status} for {request.url}, retry in {delay:.0f}s")
+                from twisted.internet import reactor
+                await maybe_deferred_to_future(deferLater(reactor, delay, lambda: None))
+        return super().process_response(request, response, spider)
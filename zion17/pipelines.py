@@ -7,14 +7,94 @@
 # useful for handling different item types with a single interface
 # from itemadapter import ItemAdapter
 
+import logging
+import time
+from collections import Counter
+
 import psycopg2
+from psycopg2.extras import execute_values
 from omegaconf import OmegaConf
 
+from zion17.metrics import Stage, add_db_time
+from zion17.spiders.parsers import NBRB_BANK_ID
+
 conf = OmegaConf.load('conf/server/db/postgres.yaml')
 
+logger = logging.getLogger(__name__)
+
+KEY_COLUMNS = ('date_page', 'myfin_bank_id')
+
+COLUMNS = (
+    'myfin_bank_id',
+    'price_value_usd_sell',
+    'price_value_usd_buy',
+    'price_value_eur_sell',
+    'price_value_eur_buy',
+    'price_value_rub_sell',
+    'price_value_rub_buy',
+    'date_page',
+    'bank_name',
+)
+
+VALUE_COLUMNS = tuple(column for column in COLUMNS if column not in KEY_COLUMNS)
+
+# rows that did not change are not rewritten, so re-crawls are no-ops
+UPSERT_QUERY = f"""
+    insert into myfin_raw.myfin_by as t ({', '.join(COLUMNS)})
+    values %s
+    on conflict ({', '.join(KEY_COLUMNS)}) do update
+    set ({', '.join(VALUE_COLUMNS)}) = ({', '.join('excluded.' + c for c in VALUE_COLUMNS)})
+    where ({', '.join('t.' + c for c in VALUE_COLUMNS)})
+        is distinct from ({', '.join('excluded.' + c for c in VALUE_COLUMNS)})
+"""
+
+# crawl_state keeps one row per fetched (source, date_page), the spiders
+# look for missing dates there instead of scanning the raw table
+CRAWL_STATE_QUERY = """
+    insert into myfin_raw.crawl_state as t (source, date_page, status, rows, fetched_at)
+    values %s
+    on conflict (source, date_page) do update
+    set status = excluded.status, rows = excluded.rows, fetched_at = excluded.fetched_at
+"""
+
+def crawl_source(row):
+    return 'nbrb' if str(row[COLUMNS.index('myfin_bank_id')]) == str(NBRB_BANK_ID) else 'banks'
+
+
 class MyfinPipeline:
+    """
+    Buffers scraped rows and upserts them in batches over a single connection.
 
-    def __init__(self):
+    Rows are keyed by (date_page, myfin_bank_id), so re-crawling a date
+    updates the stored rates instead of duplicating them. The buffer is
+    flushed when it reaches MYFIN_PIPELINE_BATCH_SIZE rows or when
+    MYFIN_PIPELINE_FLUSH_INTERVAL seconds passed since the last flush,
+    and once more when the spider is closed.
+
+    Every flush also records the fetched dates in myfin_raw.crawl_state.
+    Items in, rows written and the time spent in the database go to
+    logs/metrics.jsonl as the pipeline.myfin stage.
+    """
+
+    def __init__(self, batch_size=500, flush_interval=30):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.buffer = {}
+        self.page_rows = Counter()
+        self.last_flush = time.monotonic()
+        self.connection = None
+        self.cursor = None
+        self.stage = Stage('pipeline.myfin')
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(
+            batch_size=crawler.settings.getint('MYFIN_PIPELINE_BATCH_SIZE', 500),
+            flush_interval=crawler.settings.getfloat('MYFIN_PIPELINE_FLUSH_INTERVAL', 30),
+        )
+
+    def open_spider(self, spider):
+        self.stage.start()
         self.connection = psycopg2.connect(
             host=conf.postgres.host,
             port=conf.postgres.port,
@@ -27,67 +107,95 @@ class MyfinPipeline:
 
         self.cursor.execute("""
         CREATE TABLE IF NOT EXISTS myfin_raw.myfin_by (
-                    myfin_bank_id int4 NULL,
+                    myfin_bank_id int4 NOT NULL,
                     price_value_usd_sell numeric NULL,
                     price_value_usd_buy numeric NULL,
                     price_value_eur_sell numeric NULL,
                     price_value_eur_buy numeric NULL,
-                    price_value_rub_buy numeric NULL,
                     price_value_rub_sell numeric NULL,
-                    date_page date NULL,
-                    bank_name varchar(50) NULL
+                    price_value_rub_buy numeric NULL,
+                    date_page date NOT NULL,
+                    bank_name varchar(50) NULL,
+                    CONSTRAINT myfin_by_date_page_bank_id_key UNIQUE (date_page, myfin_bank_id)
+                );
+        CREATE TABLE IF NOT EXISTS myfin_raw.crawl_state (
+                    source varchar(20) NOT NULL,
+                    date_page date NOT NULL,
+                    status varchar(20) NOT NULL,
+                    rows int4 NOT NULL,
+                    fetched_at timestamp NOT NULL DEFAULT now(),
+                    CONSTRAINT crawl_state_pkey PRIMARY KEY (source, date_page)
                 );
+        CREATE INDEX IF NOT EXISTS crawl_state_done_idx
+                    ON myfin_raw.crawl_state (source, date_page) WHERE status = 'done';
         """)
         self.connection.commit()
+        self.last_flush = time.monotonic()
 
+    def process_item(self, item, spider):
+        self.stage.rows_in = (self.stage.rows_in or 0) + 1
+        row = tuple(item.get(column) for column in COLUMNS)
+        # the same key twice in one statement breaks ON CONFLICT DO UPDATE, keep the latest
+        self.buffer[tuple(str(item.get(column)) for column in KEY_COLUMNS)] = row
 
+        if (len(self.buffer) >= self.batch_size
+                or time.monotonic() - self.last_flush >= self.flush_interval):
+            self.flush()
 
-    def process_item(self, item, spider):
+        return item
 
-        self.connection = psycopg2.connect(
-            host=conf.postgres.host,
-            port=conf.postgres.port,
-            dbname=conf.postgres.dbname,
-            user=conf.postgres.user,
-            password=conf.postgres.password
-        )
+    def flush(self):
+        rows, self.buffer = list(self.buffer.values()), {}
+        self.last_flush = time.monotonic()
+        if not rows:
+            return
 
-        self.cursor = self.connection.cursor()
-        
+        started = time.perf_counter()
         try:
-            query = """
-                    insert into myfin_raw.myfin_by (
-                    myfin_bank_id,
-                    price_value_usd_sell,
-                    price_value_usd_buy,
-                    price_value_eur_sell,
-                    price_value_eur_buy,
-                    price_value_rub_sell,
-                    price_value_rub_buy,
-                    date_page,
-                    bank_name
-                    ) values (%s,%s,%s,%s,%s,%s,%s,%s,%s)"""
-
-            self.cursor.execute(query, (
-                item["myfin_bank_id"],
-                item["price_value_usd_sell"],
-                item["price_value_usd_buy"],
-                item["price_value_eur_sell"],
-                item["price_value_eur_buy"],
-                item["price_value_rub_sell"],
-                item["price_value_rub_buy"],
-                item["date_page"],
-                item["bank_name"]
-                ))
-            
+            execute_values(self.cursor, UPSERT_QUERY, rows, page_size=len(rows))
+            self.write_crawl_state(rows)
             self.connection.commit()
-            self.connection.close()
-        except Exception as e:
-            print(e)
-            self.connection.close()
-        
-        return item
-    
+            self.stage.rows_out = (self.stage.rows_out or 0) + len(rows)
+            logger.info(f'Flushed {len(rows)} rows to myfin_raw.myfin_by')
+        except psycopg2.Error as e:
+            # one bad row must not drop the whole batch: retry row by row
+            self.connection.rollback()
+            logger.warning(f'Batch of {len(rows)} rows failed ({e}), retrying row by row')
+            self.write_rows_one_by_one(rows)
+        finally:
+            add_db_time(time.perf_counter() - started)
+
+    def write_rows_one_by_one(self, rows):
+        written = []
+        for row in rows:
+            try:
+                execute_values(self.cursor, UPSERT_QUERY, [row])
+                self.connection.commit()
+                written.append(row)
+            except psycopg2.Error as e:
+                self.connection.rollback()
+                logger.error(f'Skip row {row}: {e}')
+        if written:
+            self.write_crawl_state(written)
+            self.connection.commit()
+            self.stage.rows_out = (self.stage.rows_out or 0) + len(written)
+        logger.info(f'Flushed {len(written)} of {len(rows)} rows to myfin_raw.myfin_by')
+
+    def write_crawl_state(self, rows):
+        # a page can be split between flushes, so rows are counted over the whole run
+        pages = Counter((crawl_source(row), row[COLUMNS.index('date_page')]) for row in rows)
+        self.page_rows.update(pages)
+        execute_values(
+            self.cursor,
+            CRAWL_STATE_QUERY,
+            [(source, date_page, 'done', self.page_rows[(source, date_page)]) for source, date_page in pages],
+            template='(%s, %s, %s, %s, now())'
+        )
+
     def close_spider(self, spider):
-        self.cursor.close()
-        self.connection.close()
+        try:
+            self.flush()
+        finally:
+            self.cursor.close()
+            self.connection.close()
+            self.stage.stop()
@@ -0,0 +1,80 @@
+# Re-parses the archived myfin.by pages without touching the network
+#
+#     python -m zion17.replay --from-dt 2024-01-01 --to-dt 2024-03-01 --workers 8
+#
+# Pages are parsed in a process pool at full CPU speed, the items go to
+# the database through MyfinPipeline like during a crawl.
+
+import argparse
+import logging
+import time
+from multiprocessing import Pool
+
+from scrapy.http import HtmlResponse
+from scrapy.utils.project import get_project_settings
+
+from zion17.pipelines import MyfinPipeline
+from zion17.snapshots import SnapshotStore
+from zion17.spiders import parsers
+
+logger = logging.getLogger(__name__)
+
+
+def parse_snapshot(args):
+    root, source, date_page = args
+    url, body = SnapshotStore(root).load(source, date_page)
+    response = HtmlResponse(url=url, body=body, encoding='utf-8')
+
+    page_date = parsers.parse_date_page(response.selector.root)
+    items = list(parsers.parse_banks(response, page_date))
+    items.extend(parsers.parse_nbrb(response, page_date))
+    return [dict(item) for item in items]
+
+
+def replay(from_dt=None, to_dt=None, source='myfin', workers=None, dry_run=False):
+    settings = get_project_settings()
+    store = SnapshotStore(settings.get('MYFIN_SNAPSHOT_DIR'))
+    tasks = [(store.root, source, date_page) for date_page in store.dates(source, from_dt, to_dt)]
+
+    pipeline = None
+    if not dry_run:
+        pipeline = MyfinPipeline(
+            batch_size=settings.getint('MYFIN_PIPELINE_BATCH_SIZE'),
+            flush_interval=settings.getfloat('MYFIN_PIPELINE_FLUSH_INTERVAL'),
+        )
+        pipeline.open_spider(None)
+
+    started = time.perf_counter()
+    pages = rows = 0
+    try:
+        with Pool(workers) as pool:
+            for items in pool.imap_unordered(parse_snapshot, tasks, chunksize=8):
+                pages += 1
+                rows += len(items)
+                if pipeline is not None:
+                    for item in items:
+                        pipeline.process_item(item, None)
+    finally:
+        if pipeline is not None:
+            pipeline.close_spider(None)
+
+    elapsed = time.perf_counter() - started
+    logger.info(f'Replayed {pages} pages, {rows} rows in {elapsed:.1f}s ({pages / max(elapsed, 1e-9):.1f} pages/s)')
+    return pages, rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Re-parse archived myfin.by pages')
+    parser.add_argument('--from-dt', help='first page date, YYYY-MM-DD')
+    parser.add_argument('--to-dt', help='last page date, YYYY-MM-DD')
+    parser.add_argument('--source', default='myfin')
+    parser.add_argument('--workers', type=int, default=None, help='parser processes, all CPUs by default')
+    parser.add_argument('--dry-run', action='store_true', help='parse only, do not write to the database')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s: %(levelname)s: %(message)s")
+    replay(args.from_dt, args.to_dt, args.source, args.workers, args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
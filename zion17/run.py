@@ -0,0 +1,180 @@
+# Runs the daily pipeline in one process
+#
+#     python -m zion17.run                        # skips the stages already done today
+#     python -m zion17.run --from-stage train     # re-runs train and every stage after it
+#     python -m zion17.run --force --full         # everything, the mart from scratch
+#
+# crawl -> features -> train -> predict -> viz -> send. The analytics scripts
+# are imported once, share one database engine (analytics/db.py) and hand the
+# mart series and the trained model to each other in memory. A stage is up to
+# date when it finished today after every stage it depends on, so re-running
+# after a failure resumes from the failed stage. Every stage is also recorded
+# in logs/metrics.jsonl as run.<stage> (python -m zion17.metrics report).
+
+import argparse
+import importlib
+import json
+import logging
+import sys
+import time
+from contextlib import chdir
+from datetime import date, datetime
+from pathlib import Path
+
+from zion17.metrics import Stage
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+ANALYTICS_DIR = ROOT_DIR / 'analytics'
+STATE_FILE = ROOT_DIR / 'logs' / 'run_state.json'
+
+logger = logging.getLogger(__name__)
+
+
+def analytics_module(name):
+    if str(ANALYTICS_DIR) not in sys.path:
+        sys.path.insert(0, str(ANALYTICS_DIR))
+    return importlib.import_module(name)
+
+
+def mart(context):
+    # read once after the mart is built, then passed from stage to stage
+    if 'mart' not in context:
+        context['mart'] = analytics_module('snapshot').read_table('mart')
+    return context['mart']
+
+
+def crawl(context):
+    from scrapy.crawler import CrawlerProcess
+    from scrapy.utils.log import get_scrapy_root_handler
+    from scrapy.utils.project import get_project_settings
+
+    # scrapy installs its own root handler (LOG_FILE), the pipeline one is back after the crawl
+    handlers = logging.root.handlers[:]
+    for handler in handlers:
+        logging.root.removeHandler(handler)
+    try:
+        process = CrawlerProcess(get_project_settings())
+        crawler = process.create_crawler('myfin')
+        process.crawl(crawler)
+        process.start()
+    finally:
+        logging.root.removeHandler(get_scrapy_root_handler())
+        sys.stdout = sys.__stdout__
+        for handler in handlers:
+            logging.root.addHandler(handler)
+        logging.root.setLevel(logging.INFO)
+
+    reason = crawler.stats.get_value('finish_reason')
+    if reason != 'finished':
+        raise RuntimeError(f'Crawl finished with {reason}')
+    return crawler.stats.get_value('item_scraped_count', 0)
+
+
+def features(context):
+    return analytics_module('01_preparing_data_for_model').main(full=context['full'])
+
+
+def train(context):
+    context['models'] = analytics_module('02_model_training').main(mart(context))
+
+
+def predict(context):
+    context['predict'] = analytics_module('03_predict').main(mart(context), context.get('models'))
+
+
+def viz(context):
+    analytics_module('04_visualization').main(mart(context), context.get('predict'))
+
+
+def send(context):
+    return analytics_module('05_send_stat').main()
+
+
+# stage -> (function, working directory, stages it depends on), in run order
+STAGES = {
+    'crawl': (crawl, ROOT_DIR, []),
+    'features': (features, ANALYTICS_DIR, ['crawl']),
+    'train': (train, ANALYTICS_DIR, ['features']),
+    'predict': (predict, ANALYTICS_DIR, ['train']),
+    'viz': (viz, ANALYTICS_DIR, ['predict']),
+    'send': (send, ANALYTICS_DIR, ['viz']),
+}
+
+
+def load_state():
+    return json.loads(STATE_FILE.read_text()) if STATE_FILE.exists() else {}
+
+
+def save_state(state):
+    tmp = STATE_FILE.with_name(STATE_FILE.name + '.tmp')
+    tmp.write_text(json.dumps(state, indent=1))
+    tmp.replace(STATE_FILE)
+
+
+def is_up_to_date(stage, state):
+    finished = state.get(stage)
+    if finished is None or finished[:10] != date.today().isoformat():
+        return False
+    _, _, depends = STAGES[stage]
+    return all(state.get(dependency) is not None and state[dependency] <= finished for dependency in depends)
+
+
+def run(from_stage=None, force=False, full=False):
+    """
+    Stages are run in STAGES order, the ones before from_stage are skipped,
+    from_stage and the later ones are run even when up to date.
+    Returns the seconds spent in every stage that ran.
+    """
+    state = load_state()
+    context = {'full': full}
+    timings = {}
+    forced = force
+    for stage, (function, workdir, _) in STAGES.items():
+        if stage == from_stage:
+            forced = True
+        if from_stage is not None and not forced:
+            logger.info(f' :::   Stage {stage:<10}: skipped (before --from-stage {from_stage})')
+            continue
+        if not forced and is_up_to_date(stage, state):
+            logger.info(f' :::   Stage {stage:<10}: up to date, finished {state[stage]}')
+            continue
+
+        logger.info(f' :::   Stage {stage:<10}: start')
+        started = time.perf_counter()
+        try:
+            with chdir(workdir), Stage(f'run.{stage}'):
+                function(context)
+        except Exception:
+            logger.exception(f' :::   Stage {stage:<10}: failed after {time.perf_counter() - started:.1f}s')
+            raise
+        timings[stage] = time.perf_counter() - started
+        state[stage] = datetime.now().isoformat(timespec='seconds')
+        save_state(state)
+        logger.info(f' :::   Stage {stage:<10}: success in {timings[stage]:.1f}s')
+
+    logger.info(' :::   Pipeline: ' + ', '.join(f'{stage} {seconds:.1f}s' for stage, seconds in timings.items()))
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run crawl -> features -> train -> predict -> viz -> send in one process')
+    parser.add_argument('--from-stage', choices=list(STAGES), help='skip the earlier stages, re-run this one and the later ones')
+    parser.add_argument('--force', action='store_true', help='run every stage even when it is up to date')
+    parser.add_argument('--full', action='store_true', help='rebuild the feature mart from the whole raw history')
+    args = parser.parse_args()
+
+    STATE_FILE.parent.mkdir(exist_ok=True)
+    handler = logging.FileHandler(ROOT_DIR / 'logs' / 'logs_analytics.log')
+    handler.setFormatter(logging.Formatter("%(asctime)s: %(levelname)s: %(message)s"))
+    logging.root.addHandler(handler)
+    logging.root.setLevel(logging.INFO)
+    logging.info('----------------------------------------------')
+
+    try:
+        run(args.from_stage, args.force, args.full)
+    except Exception:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
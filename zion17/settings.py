@@ -7,6 +7,10 @@
 #     https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
 #     https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
+import os
+
+from omegaconf import OmegaConf
+
 BOT_NAME = "zion17"
 
 SPIDER_MODULES = ["zion17.spiders"]
@@ -19,20 +23,33 @@ NEWSPIDER_MODULE = "zion17.spiders"
 # Obey robots.txt rules
 ROBOTSTXT_OBEY = False
 
+# Crawl profile from conf/crawl/crawl.yaml: daily (default) or backfill
+#     ZION17_CRAWL_PROFILE=backfill scrapy crawl myfin -a from_dt=2024-01-01
+crawl_conf = OmegaConf.load('conf/crawl/crawl.yaml').crawl
+CRAWL_PROFILE = os.environ.get('ZION17_CRAWL_PROFILE', crawl_conf.profile)
+crawl_profile = crawl_conf.profiles[CRAWL_PROFILE]
+
 # Configure maximum concurrent requests performed by Scrapy (default: 16)   
 #CONCURRENT_REQUESTS = 32
 
 # Configure a delay for requests for the same website (default: 0)
 # See https://docs.scrapy.org/en/latest/topics/settings.html#download-delay
 # See also autothrottle settings and docs
-DOWNLOAD_DELAY = 3
+DOWNLOAD_DELAY = crawl_profile.download_delay
 # between 0.5 * DOWNLOAD_DELAY and 1.5 * DOWNLOAD_DELAY
 
-RANDOMIZE_DOWNLOAD_DELAY = True
+RANDOMIZE_DOWNLOAD_DELAY = crawl_profile.randomize_download_delay
 # The download delay setting will honor only one of:
-#CONCURRENT_REQUESTS_PER_DOMAIN = 16
+CONCURRENT_REQUESTS_PER_DOMAIN = crawl_profile.concurrent_requests_per_domain
 #CONCURRENT_REQUESTS_PER_IP = 16
 
+# Retry 429/5xx with exponential backoff (zion17.middlewares.MyfinRetryMiddleware)
+RETRY_ENABLED = True
+RETRY_TIMES = crawl_profile.retry_times
+RETRY_HTTP_CODES = list(crawl_profile.retry_http_codes)
+MYFIN_RETRY_BACKOFF_BASE = crawl_profile.backoff_base
+MYFIN_RETRY_BACKOFF_MAX = crawl_profile.backoff_max
+
 # Disable cookies (enabled by default)
 COOKIES_ENABLED = False
 
@@ -55,15 +72,20 @@ COOKIES_ENABLED = False
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
 DOWNLOADER_MIDDLEWARES = {
 #    "myfin.middlewares.MyfinDownloaderMiddleware": 543,
+    # below HttpCompressionMiddleware (590): the archived body is already decoded
+    "zion17.middlewares.MyfinSnapshotMiddleware": 580,
+    'scrapy.downloadermiddlewares.retry.RetryMiddleware': None,
+    "zion17.middlewares.MyfinRetryMiddleware": 550,
     'scrapy.downloadermiddlewares.useragent.UserAgentMiddleware': None,
     'scrapy_user_agents.middlewares.RandomUserAgentMiddleware': 400,
 }
 
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
-#EXTENSIONS = {
+EXTENSIONS = {
 #    "scrapy.extensions.telnet.TelnetConsole": None,
-#}
+    "zion17.extensions.MyfinCrawlStats": 500,
+}
 
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
@@ -71,26 +93,47 @@ ITEM_PIPELINES = {
    "zion17.pipelines.MyfinPipeline": 300,
 }
 
+# MyfinPipeline buffers rows and writes them in one statement per batch.
+# The buffer is flushed when it holds MYFIN_PIPELINE_BATCH_SIZE rows or
+# MYFIN_PIPELINE_FLUSH_INTERVAL seconds passed since the previous flush
+MYFIN_PIPELINE_BATCH_SIZE = 500
+MYFIN_PIPELINE_FLUSH_INTERVAL = 30
+
+# Archive of the downloaded pages for offline re-parsing (python -m zion17.replay).
+# Bodies are stored gzip-compressed by content hash, refs older than
+# MYFIN_SNAPSHOT_RETENTION_DAYS are dropped at the end of a crawl (0 keeps everything)
+MYFIN_SNAPSHOT_ENABLED = True
+MYFIN_SNAPSHOT_DIR = 'snapshots'
+MYFIN_SNAPSHOT_RETENTION_DAYS = 0
+
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
-#AUTOTHROTTLE_ENABLED = True
+AUTOTHROTTLE_ENABLED = crawl_profile.autothrottle
 # The initial download delay
-#AUTOTHROTTLE_START_DELAY = 5
+AUTOTHROTTLE_START_DELAY = crawl_profile.autothrottle_start_delay
 # The maximum download delay to be set in case of high latencies
-#AUTOTHROTTLE_MAX_DELAY = 60
+AUTOTHROTTLE_MAX_DELAY = crawl_profile.autothrottle_max_delay
 # The average number of requests Scrapy should be sending in parallel to
 # each remote server
-#AUTOTHROTTLE_TARGET_CONCURRENCY = 1.0
+AUTOTHROTTLE_TARGET_CONCURRENCY = crawl_profile.autothrottle_target_concurrency
 # Enable showing throttling stats for every response received:
 #AUTOTHROTTLE_DEBUG = False
 
 # Enable and configure HTTP caching (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html#httpcache-middleware-settings
-#HTTPCACHE_ENABLED = True
-#HTTPCACHE_EXPIRATION_SECS = 0
-#HTTPCACHE_DIR = "httpcache"
-#HTTPCACHE_IGNORE_HTTP_CODES = []
-#HTTPCACHE_STORAGE = "scrapy.extensions.httpcache.FilesystemCacheStorage"
+HTTPCACHE_ENABLED = True
+HTTPCACHE_EXPIRATION_SECS = 0
+HTTPCACHE_DIR = "httpcache"
+# FilesystemCacheStorage pruned with the snapshot archive, on MYFIN_SNAPSHOT_RETENTION_DAYS
+HTTPCACHE_STORAGE = "zion17.httpcache.MyfinCacheStorage"
+HTTPCACHE_GZIP = True
+# Pages dated more than MYFIN_HTTPCACHE_IMMUTABLE_DAYS ago are served from the cache,
+# newer ones are revalidated with conditional requests (ETag / Last-Modified)
+HTTPCACHE_POLICY = "zion17.httpcache.MyfinCachePolicy"
+MYFIN_HTTPCACHE_IMMUTABLE_DAYS = 3
+# myfin.by marks its pages as not cacheable, store them anyway
+HTTPCACHE_ALWAYS_STORE = True
+HTTPCACHE_IGNORE_RESPONSE_CACHE_CONTROLS = ["no-cache", "no-store", "private", "max-age", "must-revalidate"]
 
 # Set settings whose default value is deprecated to a future-proof value
 REQUEST_FINGERPRINTER_IMPLEMENTATION = "2.7"
@@ -0,0 +1,79 @@
+# On-disk archive of downloaded myfin.by pages
+#
+# Page bodies are stored gzip-compressed and content-addressed:
+#     objects/<sha256[:2]>/<sha256>.html.gz
+# and every (source, date_page) points to its latest body with a small ref:
+#     refs/<source>/<YYYY-MM-DD>.json
+# Identical pages are stored once, superseded bodies are removed by prune().
+
+import gzip
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta
+from pathlib import Path
+
+
+class SnapshotStore:
+
+    def __init__(self, root, retention_days=0):
+        self.root = Path(root)
+        self.retention_days = retention_days
+
+    def object_path(self, sha):
+        return self.root / 'objects' / sha[:2] / f'{sha}.html.gz'
+
+    def ref_path(self, source, date_page):
+        return self.root / 'refs' / source / f'{date_page}.json'
+
+    def save(self, source, date_page, url, body):
+        sha = hashlib.sha256(body).hexdigest()
+        path = self.object_path(sha)
+        if not path.exists():
+            write_atomic(path, gzip.compress(body))
+
+        ref = {'sha256': sha, 'url': url, 'fetched_at': datetime.now().isoformat(timespec='seconds')}
+        write_atomic(self.ref_path(source, date_page), json.dumps(ref).encode())
+        return sha
+
+    def load_ref(self, source, date_page):
+        return json.loads(self.ref_path(source, date_page).read_text())
+
+    def load(self, source, date_page):
+        ref = self.load_ref(source, date_page)
+        return ref['url'], gzip.decompress(self.object_path(ref['sha256']).read_bytes())
+
+    def dates(self, source, from_dt=None, to_dt=None):
+        # ISO dates compare correctly as strings
+        for path in sorted((self.root / 'refs' / source).glob('*.json')):
+            date_page = path.stem
+            if (from_dt is None or date_page >= from_dt) and (to_dt is None or date_page <= to_dt):
+                yield date_page
+
+    def prune(self):
+        """
+        Drops refs fetched more than retention_days ago (0 keeps them forever)
+        and deletes the objects no ref points to anymore.
+        """
+        refs = list((self.root / 'refs').glob('*/*.json'))
+        if self.retention_days:
+            expired = (datetime.now() - timedelta(days=self.retention_days)).isoformat()
+            for path in refs:
+                if json.loads(path.read_text())['fetched_at'] < expired:
+                    path.unlink()
+            refs = [path for path in refs if path.exists()]
+
+        alive = {json.loads(path.read_text())['sha256'] for path in refs}
+        removed = 0
+        for path in (self.root / 'objects').glob('*/*.html.gz'):
+            if path.name[:-len('.html.gz')] not in alive:
+                path.unlink()
+                removed += 1
+        return removed
+
+
+def write_atomic(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, path)
@@ -1,8 +1,13 @@
+from datetime import date, timedelta
+
 from omegaconf import OmegaConf
 import psycopg2 as pg
 
 conf = OmegaConf.load('conf/server/db/postgres.yaml')
 
+MYFIN_URL = 'https://myfin.by/currency/brest/{dt}'
+DEFAULT_FROM_DT = '2024-01-01'
+
 # conn = pg.connect(
 #     dbname=conf.postgres.dbname,
 #     user=conf.postgres.user,
@@ -17,7 +22,13 @@ def change_date_format(date):
     return new_date
 
 
-def check_date_to_db_banks(from_dt, to_dt):
+def check_date_to_db(sources, from_dt, to_dt):
+    """
+    Returns the dates of the period that have no finished crawl of any of the sources.
+
+    The anti-join only probes the partial index on myfin_raw.crawl_state,
+    so its cost depends on the length of the period, not on the archive size.
+    """
 
     conn = pg.connect(
     dbname=conf.postgres.dbname,
@@ -27,19 +38,20 @@ def check_date_to_db_banks(from_dt, to_dt):
     port=conf.postgres.port
     )
 
-    query = f"""
-            with SBQ as 
-            (
-                select 	distinct date_page::date
-                from 	myfin_raw.myfin_by cp 
-                where 	myfin_bank_id != 999999
-            )
+    query = """
             select 	gen_date::date::text as search_dt
-            from	generate_series(%s, %s, interval '1 day') as gen_date
-            where 	gen_date::date not in (select date_page from SBQ)
+            from	generate_series(%s::date, %s::date, interval '1 day') as gen_date
+            where 	(
+                        select  count(*)
+                        from    myfin_raw.crawl_state cs
+                        where   cs.source = any(%s)
+                        and     cs.date_page = gen_date::date
+                        and     cs.status = 'done'
+                    ) < cardinality(%s::text[])
+            order by gen_date
             """
     cursor = conn.cursor()
-    cursor.execute(query, (from_dt, to_dt))
+    cursor.execute(query, (from_dt, to_dt, list(sources), list(sources)))
     search_dt = [change_date_format(row[0]) for row in cursor.fetchall()]
     cursor.close()
     conn.close()
@@ -47,34 +59,33 @@ def check_date_to_db_banks(from_dt, to_dt):
     return search_dt
 
 
+def check_date_to_db_banks(from_dt, to_dt):
+    return check_date_to_db(['banks'], from_dt, to_dt)
+
+
 def check_date_to_db_nbrb(from_dt, to_dt):
+    return check_date_to_db(['nbrb'], from_dt, to_dt)
 
-    conn = pg.connect(
-    dbname=conf.postgres.dbname,
-    user=conf.postgres.user,
-    password=conf.postgres.password,
-    host=conf.postgres.host,
-    port=conf.postgres.port
-    )
 
-    query = f"""
-            with SBQ as 
-            (
-                select 	distinct date_page::date
-                from 	myfin_raw.myfin_by cp 
-                where 	myfin_bank_id = 999999
-            )
-            select 	gen_date::date::text as search_dt
-            from	generate_series(%s, %s, interval '1 day') as gen_date
-            where 	gen_date::date not in (select date_page from SBQ)
-            """
-    cursor = conn.cursor()
-    cursor.execute(query, (from_dt, to_dt))
-    search_dt = [change_date_format(row[0]) for row in cursor.fetchall()]
-    cursor.close()
-    conn.close()
+def date_range(from_dt, to_dt):
+    dt = date.fromisoformat(from_dt)
+    while dt <= date.fromisoformat(to_dt):
+        yield dt.strftime('%d-%m-%Y')
+        dt += timedelta(days=1)
 
-    return search_dt
+
+def search_dates(sources, from_dt=None, to_dt=None):
+    """
+    Yields the page dates the spider has to crawl.
+
+    An explicit from_dt crawls the whole period without touching the database,
+    otherwise only the dates missing in crawl_state since DEFAULT_FROM_DT are returned.
+    """
+    to_dt = to_dt or date.today().strftime('%Y-%m-%d')
+    if from_dt:
+        yield from date_range(from_dt, to_dt)
+    else:
+        yield from check_date_to_db(sources, DEFAULT_FROM_DT, to_dt)
 
 if __name__ == "__main__":
     pass
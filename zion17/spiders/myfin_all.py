@@ -0,0 +1,26 @@
+import scrapy
+from . import generate_date_list as gdl
+from . import parsers
+
+
+
+class MyFinSpider(scrapy.Spider):
+    """
+    Crawls the commercial banks and NBRB rates from a single download of each page.
+    """
+
+    name = 'myfin'
+    allowed_domain = ['myfin.by']
+
+    # period to crawl: scrapy crawl myfin -a from_dt=2024-01-01 -a to_dt=2024-03-01
+    from_dt = None
+    to_dt = None
+
+    def start_requests(self):
+        for dt in gdl.search_dates(['banks', 'nbrb'], self.from_dt, self.to_dt):
+            yield scrapy.Request(gdl.MYFIN_URL.format(dt=dt), callback=self.parse, meta={'dt': dt})
+
+    def parse(self, response):
+        date_page = parsers.parse_date_page(response.selector.root)
+        yield from parsers.parse_banks(response, date_page)
+        yield from parsers.parse_nbrb(response, date_page)
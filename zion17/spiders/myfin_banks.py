@@ -1,41 +1,21 @@
 import scrapy
-from zion17.items import MyfinItem
 from . import generate_date_list as gdl
-from tqdm import tqdm
-from datetime import date
+from . import parsers
 
 
 
 class MyFinBanksSpider(scrapy.Spider):
 
-    dt_today = date.today().strftime("%Y-%m-%d")
-    dt_list = gdl.check_date_to_db_banks('2024-01-01', dt_today) 
-
     name = 'banks'
     allowed_domain = ['myfin.by']
 
-    start_urls = []
+    # period to crawl: scrapy crawl banks -a from_dt=2024-01-01 -a to_dt=2024-03-01
+    from_dt = None
+    to_dt = None
 
-    for dt in dt_list:
-        start_urls.append(
-            f'https://myfin.by/currency/brest/{dt}'
-        )
+    def start_requests(self):
+        for dt in gdl.search_dates(['banks'], self.from_dt, self.to_dt):
+            yield scrapy.Request(gdl.MYFIN_URL.format(dt=dt), callback=self.parse, meta={'dt': dt})
 
     def parse(self, response):
-        myfin_item = MyfinItem()
-
-        table_rows = response.xpath('.//*[@class="sort_body"]/tr')
-        date_page = response.xpath('.//*[@class="top-content__inline-title"]/h1/text()')
-
-        for row in tqdm(table_rows):
-            myfin_item['date_page'] = date_page[1].extract().split()[1].split('.')[2] + '-' + date_page[1].extract().split()[1].split('.')[1] + '-' + date_page[1].extract().split()[1].split('.')[0]
-            myfin_item['myfin_bank_id'] = row.xpath('./@id')[0].extract().split('-')[2]
-            myfin_item['bank_name'] = row.xpath('./td/span/span/img/@alt')[0].extract()
-            myfin_item['price_value_usd_sell'] = row.xpath('./td[@class="currencies-courses__currency-cell"]/span/text()')[0].extract()
-            myfin_item['price_value_usd_buy'] = row.xpath('./td[@class="currencies-courses__currency-cell"]/span/text()')[1].extract()
-            myfin_item['price_value_eur_sell'] = row.xpath('./td[@class="currencies-courses__currency-cell"]/span/text()')[2].extract()
-            myfin_item['price_value_eur_buy'] = row.xpath('./td[@class="currencies-courses__currency-cell"]/span/text()')[3].extract()
-            myfin_item['price_value_rub_sell'] = row.xpath('./td[@class="currencies-courses__currency-cell"]/span/text()')[4].extract()
-            myfin_item['price_value_rub_buy'] = row.xpath('./td[@class="currencies-courses__currency-cell"]/span/text()')[5].extract()
-            
-            yield myfin_item
+        yield from parsers.parse_banks(response)
@@ -0,0 +1,89 @@
+# Parsing of the myfin.by currency page
+#
+# The same page holds the commercial banks table and the NBRB block,
+# so every spider shares these functions
+
+import logging
+
+from lxml import etree
+
+from zion17.items import MyfinItem
+
+# XPath expressions are compiled once at import and evaluated on the lxml tree
+# behind the scrapy response, every row's cells are extracted in a single call
+DATE_PAGE_XPATH = etree.XPath('.//*[@class="top-content__inline-title"]/h1/text()')
+TABLE_ROWS_XPATH = etree.XPath('.//*[@class="sort_body"]/tr')
+ROW_ID_XPATH = etree.XPath('./@id')
+ROW_BANK_NAME_XPATH = etree.XPath('./td/span/span/img/@alt')
+ROW_PRICES_XPATH = etree.XPath('./td[@class="currencies-courses__currency-cell"]/span/text()')
+# one expression per NBRB block, so a stray node in a block cannot shift the other rates
+NBRB_PRICES_XPATH = {
+    currency: etree.XPath(
+        './/*[@class="course-brief-info course-brief-info--nbrb course-brief-info--desk"]'
+        f'/div[2]/div[{position}]/div[1]/span/text()'
+    )
+    for currency, position in (('usd', 2), ('eur', 4), ('rub', 6))
+}
+
+PRICE_FIELDS = (
+    'price_value_usd_sell',
+    'price_value_usd_buy',
+    'price_value_eur_sell',
+    'price_value_eur_buy',
+    'price_value_rub_sell',
+    'price_value_rub_buy',
+)
+
+NBRB_BANK_ID = 999999
+
+logger = logging.getLogger(__name__)
+
+
+def parse_date_page(root):
+    # header text looks like ' на 05.03.2024 в Бресте', converted to 2024-03-05
+    day, month, year = DATE_PAGE_XPATH(root)[1].split()[1].split('.')
+    return f'{year}-{month}-{day}'
+
+
+def parse_banks(response, date_page=None):
+    root = response.selector.root
+    date_page = date_page or parse_date_page(root)
+
+    for row in TABLE_ROWS_XPATH(root):
+        myfin_item = MyfinItem(
+            date_page=date_page,
+            myfin_bank_id=str(ROW_ID_XPATH(row)[0]).split('-')[2],
+            bank_name=str(ROW_BANK_NAME_XPATH(row)[0]),
+        )
+        prices = ROW_PRICES_XPATH(row)
+        if len(prices) < len(PRICE_FIELDS):
+            # a row without all six rates is skipped rather than stored with NULL prices
+            logger.warning(
+                f"{response.url}: {myfin_item['bank_name']} has {len(prices)} of "
+                f"{len(PRICE_FIELDS)} prices, row skipped"
+            )
+            continue
+        for field, price in zip(PRICE_FIELDS, prices):
+            myfin_item[field] = str(price)
+
+        yield myfin_item
+
+
+def parse_nbrb(response, date_page=None):
+    root = response.selector.root
+    date_page = date_page or parse_date_page(root)
+
+    # NBRB publishes a single rate, it is stored as both sell and buy
+    usd, eur, rub = (str(NBRB_PRICES_XPATH[currency](root)[0]) for currency in ('usd', 'eur', 'rub'))
+
+    yield MyfinItem(
+        date_page=date_page,
+        myfin_bank_id=NBRB_BANK_ID,
+        bank_name='НБРБ',
+        price_value_usd_sell=usd,
+        price_value_usd_buy=usd,
+        price_value_eur_sell=eur,
+        price_value_eur_buy=eur,
+        price_value_rub_sell=rub,
+        price_value_rub_buy=rub,
+    )